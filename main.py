@@ -9,15 +9,54 @@ from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Depends, Security, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Union
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 import openpyxl
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.packaging.custom import IntProperty, CustomPropertyList
+from openpyxl.cell._writer import etree_write_cell
+from openpyxl.xml.functions import fromstring as xml_fromstring, tostring as xml_tostring
+from openpyxl.utils.cell import column_index_from_string
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+from openpyxl.styles.numbers import BUILTIN_FORMATS, BUILTIN_FORMATS_MAX_SIZE
+from openpyxl.styles.stylesheet import Stylesheet
+from openpyxl.reader.strings import read_string_table
+from openpyxl.worksheet._reader import _cast_number
+from openpyxl.xml.constants import SHEET_MAIN_NS, REL_NS, PKG_REL_NS
 from pathlib import Path
+import bisect
+import stat
+import tempfile
+import posixpath
+import re
+import shutil
+import zipfile
 import threading
+import weakref
+import asyncio
+import functools
 import time
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from datetime import datetime
+import json
+import base64
+import operator
+from datetime import datetime, date, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支援 fcntl，只能使用行程內鎖定
+    fcntl = None
+
+try:
+    import msgpack
+except ImportError:  # 未安裝時不提供 msgpack 讀取格式
+    msgpack = None
 
 load_dotenv()
 
@@ -27,10 +66,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 不論目前是否啟用日誌，殘留的日誌都代表已回覆成功的寫入，啟動時先寫回 xlsx
+    await run_in_excel_executor(journal.recover, EXCEL_ROOT_DIR)
+    yield
+    await run_in_excel_executor(journal.checkpoint_all)
+
 app = FastAPI(
     title="Excel API Server",
     description="並發安全的 Excel 檔案操作 API",
-    version="3.4.1"
+    version="3.4.1",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -45,54 +92,601 @@ security = HTTPBearer()
 API_TOKEN = os.getenv("API_TOKEN", "your-secret-token-here")
 EXCEL_ROOT_DIR = Path(os.getenv("EXCEL_ROOT_DIR", "./data"))
 EXCEL_ROOT_DIR.mkdir(exist_ok=True)
+LOOKUP_INDEX_ENABLED = os.getenv("LOOKUP_INDEX_ENABLED", "true").lower() == "true"
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "false").lower() == "true"
+XML_APPEND_ENABLED = os.getenv("XML_APPEND_ENABLED", "true").lower() == "true"
 
 
 # ============================================================================
 # 文件鎖定管理器
 # ============================================================================
 
-class FileLockManager:
+class _LockWaiter:
+    """等待鎖定的請求，可為同步執行緒(Event)或 asyncio 協程(Future)"""
+    def __init__(self, shared: bool, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.shared = shared
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.future = loop.create_future()
+    
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+    
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+class _LockEntry:
+    """單一檔案的鎖定狀態；refs 為持有者與等待者的數量，歸零時即移除"""
     def __init__(self):
-        self.locks: Dict[str, threading.Lock] = {}
+        self.writer = False
+        self.readers = 0
+        self.waiters = deque()
+        self.refs = 0
+    
+    @property
+    def held(self) -> bool:
+        return self.writer or self.readers > 0
+
+class FileLockManager:
+    """
+    事件驅動的公平讀寫鎖定
+    - 共用模式(shared)：多個讀取者可同時持有
+    - 獨佔模式(exclusive)：寫入者單獨持有
+    釋放時依到達順序(FIFO)直接交給等待者；已有寫入者在等待時，新的讀取者需排在其後(寫入者優先)
+    
+    backend="file" 時，取得行程內鎖定後還會對旁路鎖定檔 (.<檔名>.lock) 加上 flock，
+    讓多個 uvicorn worker 行程之間也互斥
+    """
+    def __init__(self, backend: str = "thread"):
+        if backend == "file" and fcntl is None:
+            logger.warning("LOCK_BACKEND=file requires fcntl, falling back to thread backend")
+            backend = "thread"
+        if backend not in ("thread", "file"):
+            raise ValueError(f"Unknown lock backend: {backend}")
+        self.backend = backend
+        self.locks: Dict[str, _LockEntry] = {}
         self.lock_times: Dict[str, float] = {}
+        self._os_locks: Dict[str, List[int]] = {}
         self._manager_lock = threading.Lock()
         self.default_timeout = float(os.getenv("LOCK_TIMEOUT", "30.0"))
-        logger.info(f"FileLockManager initialized with default_timeout={self.default_timeout}s")
+        self.stats = {"acquisitions": 0, "timeouts": 0, "total_wait": 0.0, "max_wait": 0.0}
+        logger.info(f"FileLockManager initialized with backend={self.backend}, default_timeout={self.default_timeout}s")
+    
+    @staticmethod
+    def lock_file_path(file_path: str) -> Path:
+        path = Path(file_path)
+        return path.parent / f".{path.name}.lock"
+    
+    def _try_os_lock(self, file_path: str, shared: bool) -> bool:
+        """嘗試(不阻塞)取得跨行程的 flock，成功時保存檔案描述子供 release 使用"""
+        fd = os.open(self.lock_file_path(file_path), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except Exception:
+            os.close(fd)
+            raise
+        with self._manager_lock:
+            self._os_locks.setdefault(file_path, []).append(fd)
+        return True
+    
+    def _release_os_lock(self, file_path: str):
+        with self._manager_lock:
+            fds = self._os_locks.get(file_path)
+            if not fds:
+                return
+            fd = fds.pop()
+            if not fds:
+                del self._os_locks[file_path]
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    
+    def _os_lock(self, file_path: str, shared: bool, deadline: float) -> bool:
+        delay = 0.005
+        while not self._try_os_lock(file_path, shared):
+            if time.time() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return True
+    
+    async def _os_lock_async(self, file_path: str, shared: bool, deadline: float) -> bool:
+        delay = 0.005
+        while not self._try_os_lock(file_path, shared):
+            if time.time() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return True
+    
+    def _grant_waiters(self, file_path: str, entry: _LockEntry) -> List[_LockWaiter]:
+        """依佇列順序授予鎖定：開頭連續的讀取者一起授予，或單一寫入者"""
+        granted = []
+        while entry.waiters and not entry.writer:
+            waiter = entry.waiters[0]
+            if not waiter.shared and entry.readers > 0:
+                break
+            entry.waiters.popleft()
+            waiter.granted = True
+            granted.append(waiter)
+            if waiter.shared:
+                entry.readers += 1
+            else:
+                entry.writer = True
+        if granted and file_path not in self.lock_times:
+            self.lock_times[file_path] = time.time()
+        return granted
+    
+    def _enqueue(self, file_path: str, shared: bool,
+                 loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_LockWaiter]:
+        """立即取得鎖定時返回 None，否則加入等待佇列並返回等待者"""
+        with self._manager_lock:
+            entry = self.locks.get(file_path)
+            if entry is None:
+                entry = self.locks[file_path] = _LockEntry()
+            entry.refs += 1
+            if not entry.writer and not entry.waiters and (shared or entry.readers == 0):
+                if not entry.held:
+                    self.lock_times[file_path] = time.time()
+                if shared:
+                    entry.readers += 1
+                else:
+                    entry.writer = True
+                return None
+            waiter = _LockWaiter(shared, loop)
+            entry.waiters.append(waiter)
+            return waiter
+    
+    def _abandon(self, file_path: str, waiter: _LockWaiter) -> bool:
+        """放棄等待；若鎖定已在此之前交給該等待者則返回 True"""
+        with self._manager_lock:
+            if waiter.granted:
+                return True
+            granted = []
+            entry = self.locks.get(file_path)
+            if entry is not None and waiter in entry.waiters:
+                entry.waiters.remove(waiter)
+                entry.refs -= 1
+                if entry.refs == 0:
+                    del self.locks[file_path]
+                else:
+                    # 放棄的寫入者可能擋住了後面的讀取者
+                    granted = self._grant_waiters(file_path, entry)
+        for other in granted:
+            other.wake()
+        return False
     
-    def get_lock(self, file_path: str) -> threading.Lock:
+    def _record(self, file_path: str, start_time: float, acquired: bool, shared: bool) -> bool:
+        wait_time = time.time() - start_time
+        mode = "shared" if shared else "exclusive"
         with self._manager_lock:
-            if file_path not in self.locks:
-                self.locks[file_path] = threading.Lock()
-            return self.locks[file_path]
+            if acquired:
+                self.stats["acquisitions"] += 1
+                self.stats["total_wait"] += wait_time
+                self.stats["max_wait"] = max(self.stats["max_wait"], wait_time)
+            else:
+                self.stats["timeouts"] += 1
+        if acquired:
+            logger.info(f"Lock acquired for {file_path} ({mode}, waited {wait_time:.3f}s)")
+        else:
+            logger.error(f"Lock timeout for {file_path} ({mode}) after {wait_time:.2f}s")
+        return acquired
     
-    def acquire(self, file_path: str, timeout: float = None) -> bool:
+    def acquire(self, file_path: str, timeout: float = None, shared: bool = False) -> bool:
         if timeout is None:
             timeout = self.default_timeout
         
-        lock = self.get_lock(file_path)
         start_time = time.time()
+        waiter = self._enqueue(file_path, shared)
+        acquired = waiter is None or waiter.event.wait(timeout) or self._abandon(file_path, waiter)
+        if acquired and self.backend == "file" and not self._os_lock(file_path, shared, start_time + timeout):
+            self._release_local(file_path)
+            acquired = False
+        return self._record(file_path, start_time, acquired, shared)
+    
+    async def acquire_async(self, file_path: str, timeout: float = None, shared: bool = False) -> bool:
+        """acquire 的非同步版本，等待期間不會阻塞事件迴圈"""
+        if timeout is None:
+            timeout = self.default_timeout
         
-        while True:
-            if lock.acquire(blocking=False):
-                self.lock_times[file_path] = time.time()
-                logger.info(f"Lock acquired for {file_path}")
-                return True
-            
-            if time.time() - start_time > timeout:
-                logger.error(f"Lock timeout for {file_path} after {timeout}s")
-                return False
-            
-            time.sleep(0.1)
+        start_time = time.time()
+        waiter = self._enqueue(file_path, shared, asyncio.get_running_loop())
+        acquired = True
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.future, timeout)
+            except asyncio.TimeoutError:
+                acquired = self._abandon(file_path, waiter)
+            except asyncio.CancelledError:
+                # 請求被取消時，若鎖定已交給此等待者，需轉交給下一位
+                if self._abandon(file_path, waiter):
+                    self._release_local(file_path)
+                raise
+        if acquired and self.backend == "file":
+            try:
+                os_locked = await self._os_lock_async(file_path, shared, start_time + timeout)
+            except BaseException:
+                self._release_local(file_path)
+                raise
+            if not os_locked:
+                self._release_local(file_path)
+                acquired = False
+        return self._record(file_path, start_time, acquired, shared)
     
     def release(self, file_path: str):
-        lock = self.get_lock(file_path)
-        if lock.locked():
-            lock.release()
-            elapsed = time.time() - self.lock_times.get(file_path, 0)
-            logger.info(f"Lock released for {file_path} (held for {elapsed:.2f}s)")
+        """釋放鎖定；持有模式由目前狀態判斷(寫入者持有時不會有讀取者)"""
+        if self.backend == "file":
+            self._release_os_lock(file_path)
+        self._release_local(file_path)
+    
+    def _release_local(self, file_path: str):
+        with self._manager_lock:
+            entry = self.locks.get(file_path)
+            if entry is None or not entry.held:
+                return
+            if entry.writer:
+                entry.writer = False
+            else:
+                entry.readers -= 1
+            entry.refs -= 1
+            
+            elapsed = time.time() - self.lock_times.get(file_path, time.time())
+            granted = []
+            if not entry.held:
+                self.lock_times.pop(file_path, None)
+                granted = self._grant_waiters(file_path, entry)
+                if entry.refs == 0:
+                    del self.locks[file_path]
+        for waiter in granted:
+            waiter.wake()
+        logger.info(f"Lock released for {file_path} (held for {elapsed:.2f}s)")
+
+
+file_lock_manager = FileLockManager(backend=os.getenv("LOCK_BACKEND", "thread"))
+
+# POSIX 的 os.replace 可以取代仍被開啟的檔案，讀取者不需鎖定；
+# Windows 上只要有其他代碼開啟檔案，取代就會失敗，因此讀取者開啟檔案期間需持有共用鎖定
+READER_LOCK_REQUIRED = os.name == "nt"
+
+async def acquire_reader_lock(file_path: Path) -> None:
+    """需要時(READER_LOCK_REQUIRED)取得讀取用的共用鎖定，逾時返回 503"""
+    if READER_LOCK_REQUIRED and not await file_lock_manager.acquire_async(str(file_path), shared=True):
+        raise HTTPException(status_code=503, detail="File is locked")
+
+def release_reader_lock(file_path: Path) -> None:
+    if READER_LOCK_REQUIRED:
+        file_lock_manager.release(str(file_path))
+
+@asynccontextmanager
+async def reader_lock(file_path: Path):
+    await acquire_reader_lock(file_path)
+    try:
+        yield
+    finally:
+        release_reader_lock(file_path)
+
+
+# ============================================================================
+# Excel 工作執行緒池
+# ============================================================================
+
+# openpyxl 的載入與儲存都是阻塞操作，統一交給專用執行緒池，避免卡住事件迴圈
+excel_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MAX_WORKERS", "4")),
+    thread_name_prefix="excel-worker"
+)
+
+async def run_in_excel_executor(func, *args, **kwargs):
+    """在 Excel 執行緒池中執行阻塞函數並等待結果"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(excel_executor, functools.partial(func, *args, **kwargs))
+
+
+# ============================================================================
+# 工作簿快取
+# ============================================================================
+
+# 每個儲存格在記憶體中的估計大小(位元組)，用於計算快取佔用量
+CELL_MEMORY_ESTIMATE = 300
+
+class SnapshotCell:
+    __slots__ = ("value", "number_format")
+
+    def __init__(self, value, number_format: str):
+        self.value = value
+        self.number_format = number_format
+
+def snapshot_value(value, data_type: Optional[str] = None):
+    """
+    轉換為以 data_only 重新載入時的值：公式沒有快取值因此為 None，日期轉為 datetime
+    空字串會存成沒有內容的 <c t="inlineStr"/>，重新載入時為 None
+    不知道儲存格類型時(變更紀錄)，依 openpyxl 寫入時的規則以 "=" 開頭的字串視為公式
+    """
+    if value == "" or data_type == "f" or (data_type is None and isinstance(value, str) and len(value) > 1 and value.startswith("=")):
+        return None
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+class SheetSnapshot:
+    """
+    已提交版本的唯讀工作表快照，提供讀取路徑使用的介面(_cells、尺寸、title)
+    內容與以 data_only 重新載入剛儲存的檔案相同
+    """
+    def __init__(self, title: str, cells: Dict[Tuple[int, int], SnapshotCell], bounds: Optional[Tuple[int, int, int, int]] = None):
+        self.title = title
+        self._cells = cells
+        if bounds is None and cells:
+            rows = [row for row, _ in cells]
+            cols = [col for _, col in cells]
+            bounds = (min(rows), max(rows), min(cols), max(cols))
+        self.min_row, self.max_row, self.min_column, self.max_column = bounds or (1, 1, 1, 1)
+
+    @classmethod
+    def from_worksheet(cls, ws) -> "SheetSnapshot":
+        cells = {}
+        for key, cell in ws._cells.items():
+            value = cell._value
+            # openpyxl 儲存時會略過沒有值、樣式與註解的儲存格；合併範圍內的儲存格載入時一律會重建
+            if value is None and not cell.has_style and cell._comment is None and not isinstance(cell, MergedCell):
+                continue
+            value = snapshot_value(value, cell.data_type)
+            cells[key] = SnapshotCell(value, cell.number_format if isinstance(value, datetime) else "General")
+        return cls(ws.title, cells)
+
+    def apply(self, records: List[Dict[str, Any]]) -> "SheetSnapshot":
+        """
+        套用預寫日誌紀錄產生下一個版本(見 Journal)，本身保持不變
+        只複製儲存格對照表，未變動的儲存格物件由兩個版本共用
+        """
+        cells = dict(self._cells)
+        bounds = [self.min_row, self.max_row, self.min_column, self.max_column] if cells else None
+        for record in records:
+            if "d" in record:
+                drop = sorted(set(record["d"]))
+                drop_set = set(drop)
+                cells = {
+                    (row - bisect.bisect_left(drop, row), col): cell
+                    for (row, col), cell in cells.items() if row not in drop_set
+                }
+                bounds = None
+                continue
+            row = record["r"]
+            for col, value in record["c"]:
+                if value is None:
+                    # 與 ws.cell(value=None) 相同，不覆寫既有的值
+                    continue
+                cells[(row, col)] = SnapshotCell(snapshot_value(value), "General")
+                if bounds is not None:
+                    bounds = [min(bounds[0], row), max(bounds[1], row), min(bounds[2], col), max(bounds[3], col)]
+        return SheetSnapshot(self.title, cells, tuple(bounds) if bounds and cells else None)
+
+class WorkbookSnapshot:
+    """
+    每次儲存後發布的不可變版本，讀取者直接使用，不需重新解析檔案
+    寫入者在自己取出的工作簿上準備下一個版本，不會影響正在讀取這個版本的請求
+    """
+    def __init__(self, worksheets: List[SheetSnapshot]):
+        self.worksheets = worksheets
+        self.sheetnames = [ws.title for ws in worksheets]
+        self._sheets = dict(zip(self.sheetnames, self.worksheets))
+
+    @classmethod
+    def from_workbook(cls, wb) -> "WorkbookSnapshot":
+        return cls([SheetSnapshot.from_worksheet(ws) for ws in wb.worksheets])
+
+    def apply(self, records: List[Dict[str, Any]]) -> "WorkbookSnapshot":
+        by_sheet: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            by_sheet.setdefault(record["s"], []).append(record)
+        return WorkbookSnapshot([
+            ws.apply(by_sheet[ws.title]) if ws.title in by_sheet else ws for ws in self.worksheets
+        ])
+
+    def __getitem__(self, name: str) -> SheetSnapshot:
+        return self._sheets[name]
+
+class WorkbookCache:
+    """
+    行程內的工作簿快取，以檔案路徑為鍵，並以 (mtime_ns, size, inode) 驗證版本(日誌模式另含日誌的 size、inode)
+    超出記憶體預算時依 LRU 順序淘汰
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, bool], Tuple[Tuple[int, int, int], Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        logger.info(f"WorkbookCache initialized with max_bytes={self.max_bytes}")
+
+    @staticmethod
+    def file_version(file_path: Path) -> Optional[Tuple[int, ...]]:
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        version = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if JOURNAL_ENABLED:
+            # 日誌模式下檔案內容為檢查點加上預寫日誌，日誌增長也代表新的版本
+            try:
+                log_st = os.stat(Journal.log_path(file_path))
+            except FileNotFoundError:
+                return version
+            version += (log_st.st_size, log_st.st_ino)
+        return version
+
+    @staticmethod
+    def estimate_size(wb) -> int:
+        cells = sum(len(getattr(ws, "_cells", ())) for ws in wb.worksheets)
+        return (cells + 1) * CELL_MEMORY_ESTIMATE
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+        return entry
+
+    def _put(self, key, version, wb):
+        self._pop(key)
+        size = self.estimate_size(wb)
+        if version is None or size > self.max_bytes:
+            return
+        self._entries[key] = (version, wb, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes and self._entries:
+            evicted_key, _ = next(iter(self._entries.items()))
+            self._pop(evicted_key)
+            logger.info(f"Evicted workbook from cache: {evicted_key[0]}")
+
+    def get_versioned(self, file_path: Path, data_only: bool = False, engine: Optional[str] = None):
+        """
+        取得共用的工作簿(唯讀用途)及其檔案版本，呼叫端不可修改內容
+        data_only 項目在本行程儲存後為 WorkbookSnapshot，否則由讀取引擎 engine(預設 READ_ENGINE)從檔案載入
+        讀取者不持有鎖定：載入前後版本不同表示檔案在載入期間被取代，重新載入以確保版本與內容一致
+        """
+        key = (str(file_path), data_only)
+        while True:
+            version = self.file_version(file_path)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return version, entry[1]
+                self.misses += 1
+            if data_only:
+                wb = READ_ENGINES[engine or READ_ENGINE](file_path)
+            else:
+                wb = load_workbook_file(file_path)
+            if self.file_version(file_path) == version:
+                break
+        with self._lock:
+            self._put(key, version, wb)
+        return version, wb
+
+    def get(self, file_path: Path, data_only: bool = False):
+        return self.get_versioned(file_path, data_only)[1]
+
+    def checkout(self, file_path: Path):
+        """
+        取出可修改的工作簿(寫入用途)
+        取出後即從快取移除，直到 store() 存回，避免其他請求看到未儲存的修改
+        """
+        key = (str(file_path), False)
+        version = self.file_version(file_path)
+        with self._lock:
+            entry = self._pop(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return load_workbook_file(file_path)
 
+    def store(self, file_path: Path, wb):
+        """
+        儲存後將工作簿放回快取，並以新的檔案版本取代舊項目
+        同時發布此版本的唯讀快照，取代 data_only 項目供讀取者使用
+        """
+        version = self.file_version(file_path)
+        snapshot = WorkbookSnapshot.from_workbook(wb)
+        with self._lock:
+            self._put((str(file_path), False), version, wb)
+            self._put((str(file_path), True), version, snapshot)
 
-file_lock_manager = FileLockManager()
+    def publish(self, file_path: Path, wb, base_version, records: List[Dict[str, Any]]):
+        """
+        日誌模式與 XML 修補的 store()：檔案未完整改寫，將紀錄套用到前一版快照上發布新版本
+        前一版快照不在快取中時(已淘汰或由其他行程寫入)，移除 data_only 項目，由下一個讀取者重新載入
+        (檔案中既有公式的快取值仍在，從寫入者的工作簿建立的快照會把它們讀成 None)
+        """
+        version = self.file_version(file_path)
+        key = (str(file_path), True)
+        with self._lock:
+            entry = self._entries.get(key)
+        snapshot = None
+        if entry is not None and entry[0] == base_version:
+            base = entry[1] if isinstance(entry[1], WorkbookSnapshot) else WorkbookSnapshot.from_workbook(entry[1])
+            snapshot = base.apply(records)
+        with self._lock:
+            self._put((str(file_path), False), version, wb)
+            if snapshot is not None:
+                self._put(key, version, snapshot)
+            else:
+                self._pop(key)
+
+    def checkin(self, file_path: Path, wb):
+        """歸還以 checkout() 取出但未修改的工作簿(呼叫端需仍持有檔案鎖定)"""
+        version = self.file_version(file_path)
+        with self._lock:
+            self._put((str(file_path), False), version, wb)
+
+    def invalidate(self, file_path: Path):
+        with self._lock:
+            self._pop((str(file_path), False))
+            self._pop((str(file_path), True))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+workbook_cache = WorkbookCache(int(float(os.getenv("WORKBOOK_CACHE_MB", "256")) * 1024 * 1024))
+
+
+# ============================================================================
+# 工作表狀態
+# ============================================================================
+
+class SheetState:
+    """
+    隨工作表物件保存的衍生資訊，工作表留在快取中多久就保存多久
+    cell_count 為記錄時的儲存格數量，數量改變代表有未經追蹤的寫入，需重新計算
+    dense 表示 1..last_row 之間沒有空白列，也沒有超出 last_row 的儲存格(不需壓縮)
+    indexes 為查找索引 {欄位索引: {正規化值: [列號, ...]}}，首次查找時建立
+    headers 為表頭對照表，templates 為 {物件欄位名稱組合: ColumnTemplate}；兩者只隨第一列的寫入或刪除失效
+    """
+    def __init__(self):
+        self.last_row: Optional[int] = None
+        self.dense = False
+        self.cell_count = -1
+        self.indexes: Dict[int, Dict[str, List[int]]] = {}
+        self.headers: Optional[Dict[str, int]] = None
+        self.templates: Dict[Tuple[str, ...], "ColumnTemplate"] = {}
+    
+    def is_valid(self, ws) -> bool:
+        return self.last_row is not None and self.cell_count == len(ws._cells)
+    
+    def invalidate(self):
+        self.last_row = None
+        self.dense = False
+        self.indexes.clear()
+    
+    def invalidate_headers(self):
+        self.headers = None
+        self.templates.clear()
+
+_sheet_states: "weakref.WeakKeyDictionary[Any, SheetState]" = weakref.WeakKeyDictionary()
+_sheet_states_lock = threading.Lock()
+
+def get_sheet_state(ws) -> SheetState:
+    with _sheet_states_lock:
+        state = _sheet_states.get(ws)
+        if state is None:
+            state = _sheet_states[ws] = SheetState()
+        return state
 
 
 # ============================================================================
@@ -109,10 +703,50 @@ class AppendObjectRequest(BaseModel):
     sheet: str = Field(default="Sheet1", description="工作表名稱")
     values: Dict[str, Any] = Field(..., description="要新增的值(欄位名稱: 值)")
 
+class WhereClause(BaseModel):
+    """
+    讀取篩選條件：葉節點為 column/op/value，或以 and/or 組合多個子條件
+    op: eq, ne, in, gt, gte, lt, lte, prefix, is_null, not_null
+    """
+    column: Optional[str] = Field(None, description="表頭欄位名稱")
+    op: str = Field(default="eq", description="比較運算子")
+    value: Any = Field(None, description="比較值(in 為列表，日期使用 ISO 格式字串)")
+    and_: Optional[List["WhereClause"]] = Field(None, alias="and", description="所有子條件皆成立")
+    or_: Optional[List["WhereClause"]] = Field(None, alias="or", description="任一子條件成立")
+
+class AppendManyRequest(BaseModel):
+    file: str = Field(..., description="Excel 檔案名稱")
+    sheet: str = Field(default="Sheet1", description="工作表名稱")
+    rows: List[List[Any]] = Field(..., min_length=1, description="要新增的多列值(陣列模式)")
+
+class AppendObjectsRequest(BaseModel):
+    file: str = Field(..., description="Excel 檔案名稱")
+    sheet: str = Field(default="Sheet1", description="工作表名稱")
+    rows: List[Dict[str, Any]] = Field(..., min_length=1, description="要新增的多列值(欄位名稱: 值)")
+
+class UpsertRequest(BaseModel):
+    file: str = Field(..., description="Excel 檔案名稱")
+    sheet: str = Field(default="Sheet1", description="工作表名稱")
+    key_column: str = Field(..., description="作為主鍵的欄位名稱")
+    records: List[Dict[str, Any]] = Field(..., min_length=1, description="要更新或新增的記錄(欄位名稱: 值)，須包含主鍵欄位")
+
 class ReadRequest(BaseModel):
     file: str
     sheet: str = "Sheet1"
     range: Optional[str] = Field(None, description="範圍")
+    where: Optional[WhereClause] = Field(None, description="篩選條件，僅返回符合的資料列(表頭列一律返回)")
+    columns: Optional[List[str]] = Field(None, description="只返回指定的表頭欄位，依指定順序排列")
+    format: str = Field(default="rows", description="回應格式: rows(含表頭的二維陣列)、records、columnar 或 msgpack")
+    offset: Optional[int] = Field(None, ge=0, description="略過前 N 列(以非空白列計算，包含表頭列)")
+    limit: Optional[int] = Field(None, ge=1, description="最多返回的列數")
+    cursor: Optional[str] = Field(None, description="上一頁返回的 next_cursor，從該處繼續讀取")
+    engine: Optional[str] = Field(None, description="需要解析檔案時使用的讀取引擎: openpyxl 或 xml，預設為 READ_ENGINE")
+
+class ReadStreamRequest(BaseModel):
+    file: str
+    sheet: str = "Sheet1"
+    range: Optional[str] = Field(None, description="範圍")
+    stream_format: str = Field(default="ndjson", description="串流格式: ndjson(每列一行) 或 json(分段輸出的 JSON 陣列)")
 
 class UpdateAdvancedRequest(BaseModel):
     file: str = Field(..., description="Excel 檔案名稱")
@@ -132,10 +766,14 @@ class DeleteAdvancedRequest(BaseModel):
     process_all: Optional[bool] = Field(True, description="是否處理所有匹配記錄(預設True)")
 
 class BatchOperation(BaseModel):
-    type: str = Field(..., description="操作類型: append, update, delete")
+    type: str = Field(..., description="操作類型: append, update, delete, append_object, update_by_lookup, delete_by_lookup")
     row: Optional[int] = None
-    values: Optional[List[Any]] = None
+    values: Optional[Union[List[Any], Dict[str, Any]]] = Field(None, description="append/update 為值列表，append_object 為 {欄位名稱: 值}")
     column_start: Optional[int] = 1
+    lookup_column: Optional[str] = Field(None, description="update_by_lookup/delete_by_lookup 查找的欄位名稱")
+    lookup_value: Optional[str] = Field(None, description="update_by_lookup/delete_by_lookup 查找的值")
+    process_all: Optional[bool] = Field(True, description="是否處理所有匹配記錄(預設True)")
+    values_to_set: Optional[Dict[str, Any]] = Field(None, description="update_by_lookup 要更新的欄位與值")
 
 class BatchRequest(BaseModel):
     file: str
@@ -153,61 +791,304 @@ def validate_file_path(file_name: str) -> Path:
     file_path = EXCEL_ROOT_DIR / file_name
     return file_path
 
+def scan_last_row(ws) -> int:
+    """掃描所有儲存格，找出真正有資料的最後一行(不建立新的儲存格)"""
+    return max((row_idx for (row_idx, _), cell in ws._cells.items() if cell.value not in [None, ""]), default=0)
+
 def get_real_last_row(ws):
-    """尋找真正有資料的最後一行"""
-    for row_idx in range(ws.max_row, 0, -1):
-        for col_idx in range(1, ws.max_column + 1):
-            if ws.cell(row=row_idx, column=col_idx).value not in [None, ""]:
-                return row_idx
-    return 0
+    """尋找真正有資料的最後一行，優先使用工作表狀態中維護的標記"""
+    state = get_sheet_state(ws)
+    if not state.is_valid(ws):
+        state.invalidate()
+        state.last_row = scan_last_row(ws)
+        state.cell_count = len(ws._cells)
+    return state.last_row
+
+def normalize_lookup_value(value) -> str:
+    """查找比對時統一轉換為字串(與逐列比對時的 str() 規則相同)"""
+    return str(value)
+
+def get_lookup_index(ws, col_idx: int) -> Dict[str, List[int]]:
+    """
+    取得指定欄位的查找索引 {正規化值: [列號, ...]}(不含表頭列與空白儲存格)
+    首次使用時掃描一次建立，之後由 write_cells / delete_rows_bulk 增量維護
+    """
+    get_real_last_row(ws)
+    state = get_sheet_state(ws)
+    index = state.indexes.get(col_idx)
+    if index is None:
+        index = {}
+        for (row_idx, c), cell in ws._cells.items():
+            if c == col_idx and row_idx > 1 and cell.value is not None:
+                index.setdefault(normalize_lookup_value(cell.value), []).append(row_idx)
+        for rows in index.values():
+            rows.sort()
+        state.indexes[col_idx] = index
+        logger.info(f"Built lookup index for column {col_idx} of '{ws.title}' ({len(index)} keys)")
+    return index
+
+def shift_lookup_indexes(state: SheetState, drop: List[int]) -> None:
+    """刪除列之後調整所有查找索引中的列號"""
+    drop_set = set(drop)
+    for col_idx, index in state.indexes.items():
+        shifted = {}
+        for key, rows in index.items():
+            kept = [row_idx - bisect.bisect_left(drop, row_idx) for row_idx in rows if row_idx not in drop_set]
+            if kept:
+                shifted[key] = kept
+        state.indexes[col_idx] = shifted
+
+# 每個工作簿自上次儲存後的變更紀錄，於 save_workbook 時取出(見 Journal、append_rows_xml)
+_journal_records: "weakref.WeakKeyDictionary[Any, List[Dict[str, Any]]]" = weakref.WeakKeyDictionary()
+_journal_records_lock = threading.Lock()
+
+def record_change(ws, record: Dict[str, Any]) -> None:
+    """記錄工作表的變更，僅在 JOURNAL_ENABLED 或 XML_APPEND_ENABLED 時保留"""
+    if not (JOURNAL_ENABLED or XML_APPEND_ENABLED):
+        return
+    record["s"] = ws.title
+    with _journal_records_lock:
+        _journal_records.setdefault(ws.parent, []).append(record)
+
+def take_changes(wb) -> List[Dict[str, Any]]:
+    """取出並清除工作簿累積的變更紀錄"""
+    with _journal_records_lock:
+        return _journal_records.pop(wb, [])
+
+def write_cells(ws, row: int, cells) -> None:
+    """
+    寫入同一列的多個儲存格 [(欄位索引, 值), ...]，並維護最後資料列標記
+    所有修改儲存格值的程式都應透過此函數，讓衍生狀態保持正確
+    """
+    cells = list(cells)
+    record_change(ws, {"r": row, "c": [[col_idx, value] for col_idx, value in cells]})
+    state = get_sheet_state(ws)
+    if row == 1:
+        state.invalidate_headers()
+    tracked = state.is_valid(ws)
+    has_data = False
+    for col_idx, value in cells:
+        index = state.indexes.get(col_idx) if tracked and row > 1 else None
+        if index is not None and value is not None:
+            # ws.cell(value=None) 不會覆寫原值，因此只有非 None 的值需要更新索引
+            old_value = peek_value(ws, row, col_idx)
+            if old_value is not None:
+                old_rows = index.get(normalize_lookup_value(old_value))
+                if old_rows and row in old_rows:
+                    old_rows.remove(row)
+            bisect.insort(index.setdefault(normalize_lookup_value(value), []), row)
+        ws.cell(row=row, column=col_idx, value=value)
+        if value not in [None, ""]:
+            has_data = True
+    if not tracked:
+        state.invalidate()
+        return
+    if has_data:
+        if row > state.last_row + 1:
+            state.dense = False
+        state.last_row = max(state.last_row, row)
+    elif row == state.last_row:
+        state.invalidate()
+        return
+    else:
+        # 空值可能讓某列變成空白列，或在最後資料列之後建立空白儲存格
+        state.dense = False
+    state.cell_count = len(ws._cells)
+
+def check_cell_values(ws, cells) -> List[Tuple[int, Any]]:
+    """
+    預先以不加入工作表的儲存格檢查 openpyxl 是否接受這些值(型別、非法字元)
+    延後寫入的呼叫端(BatchPlanner)以此讓錯誤歸屬到造成它的操作；不接受時拋出與寫入時相同的例外
+    """
+    cells = list(cells)
+    for _, value in cells:
+        if value is not None:
+            Cell(ws, value=value)
+    return cells
+
+def invalidate_sheet_state(ws) -> None:
+    """列被刪除或搬移後，工作表狀態需重新計算"""
+    get_sheet_state(ws).invalidate()
+
+def compact_rows(ws, drop_rows) -> int:
+    """
+    一次移除多個列：每個保留的儲存格只搬移一次(連同樣式)，並同步調整列高與合併儲存格範圍
+    取代逐列呼叫 ws.delete_rows()(每次都會搬移其下所有列)
+    返回實際移除的列數
+    """
+    drop = sorted(set(drop_rows))
+    if not drop:
+        return 0
+    record_change(ws, {"d": drop})
+    if drop[0] == 1:
+        get_sheet_state(ws).invalidate_headers()
+    drop_set = set(drop)
+    
+    def shift(row_idx: int) -> int:
+        return bisect.bisect_left(drop, row_idx)
+    
+    moved = {}
+    for (row_idx, col_idx), cell in ws._cells.items():
+        if row_idx in drop_set:
+            continue
+        new_row = row_idx - shift(row_idx)
+        if new_row != row_idx:
+            cell.row = new_row
+        moved[(new_row, col_idx)] = cell
+    ws._cells = moved
+    
+    dimensions = list(ws.row_dimensions.items())
+    ws.row_dimensions.clear()
+    for row_idx, dim in dimensions:
+        if row_idx in drop_set:
+            continue
+        new_row = row_idx - shift(row_idx)
+        dim.index = new_row
+        ws.row_dimensions[new_row] = dim
+    
+    for merged in list(ws.merged_cells.ranges):
+        new_min = merged.min_row - shift(merged.min_row)
+        new_max = merged.max_row - bisect.bisect_right(drop, merged.max_row)
+        if new_max < new_min or (new_max == new_min and merged.min_col == merged.max_col):
+            ws.merged_cells.remove(merged)
+            continue
+        merged.min_row, merged.max_row = new_min, new_max
+    
+    return len(drop)
+
+def delete_rows_bulk(ws, rows) -> int:
+    """
+    一次刪除一組列(可不連續、不需排序)，其下各連續區段的列只搬移一次
+    若刪除前工作表狀態有效，直接推算新的最後資料列，不需重新掃描
+    """
+    state = get_sheet_state(ws)
+    tracked = state.is_valid(ws)
+    drop = sorted(set(rows))
+    deleted = compact_rows(ws, drop)
+    if tracked:
+        state.last_row -= bisect.bisect_right(drop, state.last_row)
+        state.cell_count = len(ws._cells)
+        shift_lookup_indexes(state, drop)
+    else:
+        state.invalidate()
+    return deleted
+
+def find_empty_rows(ws) -> Tuple[List[int], int]:
+    """單次掃描找出所有完全空白的行，返回 (空白列, 最後資料列)；合併儲存格涵蓋的列視為非空白"""
+    rows_with_data = set()
+    max_row = 0
+    for (row_idx, _), cell in ws._cells.items():
+        if row_idx > max_row:
+            max_row = row_idx
+        if cell.value not in [None, ""]:
+            rows_with_data.add(row_idx)
+    for merged in ws.merged_cells.ranges:
+        if merged.max_row > merged.min_row:
+            rows_with_data.update(range(merged.min_row, merged.max_row + 1))
+    empty_rows = [row_idx for row_idx in range(1, max_row + 1) if row_idx not in rows_with_data]
+    return empty_rows, max(rows_with_data, default=0)
 
 def cleanup_all_empty_rows(ws):
-    """徹底清理所有完全空白的行"""
-    rows_to_delete = []
+    """徹底清理所有完全空白的行(單次掃描、單次搬移)"""
+    state = get_sheet_state(ws)
+    tracked = state.is_valid(ws)
+    if tracked and state.dense:
+        return
     
-    for row_idx in range(ws.max_row, 0, -1):
-        is_empty = True
-        for col_idx in range(1, ws.max_column + 1):
-            if ws.cell(row=row_idx, column=col_idx).value not in [None, ""]:
-                is_empty = False
-                break
-        if is_empty:
-            rows_to_delete.append(row_idx)
+    empty_rows, last_row = find_empty_rows(ws)
+    deleted = compact_rows(ws, empty_rows)
     
-    for row_idx in sorted(rows_to_delete):
-        ws.delete_rows(row_idx, 1)
+    if tracked:
+        shift_lookup_indexes(state, empty_rows)
+    else:
+        state.indexes.clear()
+    state.last_row = last_row - bisect.bisect_left(empty_rows, last_row)
+    state.dense = True
+    state.cell_count = len(ws._cells)
     
-    if rows_to_delete:
-        logger.info(f"Deleted {len(rows_to_delete)} empty rows")
+    if deleted:
+        logger.info(f"Deleted {deleted} empty rows")
 
 def cleanup_empty_rows(ws):
     """僅刪除末尾的空白行"""
     last_row = get_real_last_row(ws)
     if ws.max_row > last_row:
         ws.delete_rows(last_row + 1, ws.max_row - last_row)
+        invalidate_sheet_state(ws)
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     if credentials.credentials != API_TOKEN:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
     return credentials.credentials
 
+def peek_cell(ws, row: int, column: int):
+    """
+    讀取儲存格但不建立新的儲存格物件(ws.cell() 會在缺少時建立)
+    多個讀取者會同時使用快取中的同一份工作表(快照)，因此不可修改工作表
+    """
+    return ws._cells.get((row, column))
+
+def peek_value(ws, row: int, column: int):
+    cell = ws._cells.get((row, column))
+    return None if cell is None else cell.value
+
 def get_headers(ws) -> Dict[str, int]:
     """
     獲取第一列作為表頭，返回 {欄位名稱: 欄位索引} 的字典
+    結果快取在工作表狀態中(工作表物件對應快取中的一個檔案版本)，呼叫端不可修改返回的字典
     """
-    headers = {}
-    for col_idx in range(1, ws.max_column + 1):
-        header_value = ws.cell(row=1, column=col_idx).value
-        if header_value:
-            headers[str(header_value)] = col_idx
+    state = get_sheet_state(ws)
+    headers = state.headers
+    if headers is None:
+        headers = {}
+        for col_idx in range(1, ws.max_column + 1):
+            header_value = peek_value(ws, 1, col_idx)
+            if header_value:
+                headers[str(header_value)] = col_idx
+        state.headers = headers
     return headers
 
-def find_all_rows_by_lookup(ws, lookup_column: str, lookup_value: str) -> List[int]:
+# 每個工作表最多保留的欄位對應範本數量，超過時整批清除
+COLUMN_TEMPLATE_LIMIT = 64
+
+class ColumnTemplate:
+    """
+    物件欄位名稱組合(依順序)對應到表頭的預先解析結果
+    columns 為依表頭順序的 [(欄位索引, 欄位名稱)]，matched/ignored 為已知與未知的欄位名稱
+    """
+    __slots__ = ("columns", "matched", "ignored")
+    
+    def __init__(self, headers: Dict[str, int], keys: Tuple[str, ...]):
+        self.columns = [(col_idx, col_name) for col_name, col_idx in headers.items()]
+        self.matched = [col for col in keys if col in headers]
+        self.ignored = [col for col in keys if col not in headers]
+    
+    def row_cells(self, values: Dict[str, Any]) -> List[Tuple[int, Any]]:
+        return [(col_idx, values.get(col_name)) for col_idx, col_name in self.columns]
+
+def get_column_template(ws, values: Dict[str, Any]) -> ColumnTemplate:
+    """
+    取得物件欄位名稱組合的對應範本，相同形狀的物件不需重新比對表頭
+    第一列沒有表頭時返回 400
+    """
+    headers = require_headers(ws)
+    templates = get_sheet_state(ws).templates
+    keys = tuple(values.keys())
+    template = templates.get(keys)
+    if template is None:
+        if len(templates) >= COLUMN_TEMPLATE_LIMIT:
+            templates.clear()
+        template = templates[keys] = ColumnTemplate(headers, keys)
+    return template
+
+def find_all_rows_by_lookup(ws, lookup_column: str, lookup_value: str, headers: Optional[Dict[str, int]] = None) -> List[int]:
     """
     根據欄位名稱和值查找所有符合條件的列號
     返回找到的列號列表(1-based)，如果沒找到返回空列表
+    headers 可傳入已取得的表頭，避免批次操作中重複讀取
     """
-    headers = get_headers(ws)
+    if headers is None:
+        headers = get_headers(ws)
     
     if lookup_column not in headers:
         raise HTTPException(
@@ -216,16 +1097,20 @@ def find_all_rows_by_lookup(ws, lookup_column: str, lookup_value: str) -> List[i
         )
     
     lookup_col_idx = headers[lookup_column]
-    matched_rows = []
+    lookup_key = normalize_lookup_value(lookup_value)
     
-    # 從第2列開始搜索(第1列是表頭)
-    for row_idx in range(2, ws.max_row + 1):
-        cell_value = ws.cell(row=row_idx, column=lookup_col_idx).value
-        # 轉換為字串進行比較
-        if str(cell_value) == str(lookup_value):
-            matched_rows.append(row_idx)
-            logger.info(f"Found match at row {row_idx}: {lookup_column}={lookup_value}")
+    if LOOKUP_INDEX_ENABLED and lookup_key != normalize_lookup_value(None):
+        # 使用雜湊索引，O(1) 找到所有符合的列
+        matched_rows = list(get_lookup_index(ws, lookup_col_idx).get(lookup_key, []))
+    else:
+        # 從第2列開始搜索(第1列是表頭)，空白儲存格以 "None" 比對
+        matched_rows = [
+            row_idx for row_idx in range(2, ws.max_row + 1)
+            if normalize_lookup_value(peek_value(ws, row_idx, lookup_col_idx)) == lookup_key
+        ]
     
+    if matched_rows:
+        logger.info(f"Found {len(matched_rows)} match(es) at rows {matched_rows}: {lookup_column}={lookup_value}")
     return matched_rows
 
 
@@ -233,107 +1118,996 @@ def find_all_rows_by_lookup(ws, lookup_column: str, lookup_value: str) -> List[i
 # Excel 操作函數
 # ============================================================================
 
+# 暫存檔由 mkstemp 以 0600 建立，新檔案改用與一般建立檔案相同的權限
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def fsync_directory(directory: Path) -> None:
+    """讓 os.replace 的目錄項目變更寫入磁碟(Windows 不支援開啟目錄，略過)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def atomic_write(file_path: Path, write) -> None:
+    """
+    以 write(f) 寫入同目錄的暫存檔並 fsync，再以 os.replace 原子性地取代原檔
+    讀取者只會看到完整的舊版或新版檔案，寫入途中失敗或當機也不會留下損壞的檔案
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_name = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    fsync_directory(file_path.parent)
+
+def atomic_save(wb, file_path: Path) -> None:
+    """以 openpyxl 完整序列化工作簿並原子性地取代原檔"""
+    atomic_write(file_path, wb.save)
+
+def load_workbook_file(file_path: Path):
+    """
+    從檔案載入寫入用的工作簿，並重播預寫日誌中尚未寫入檢查點的變更
+    讀取用途(data_only)見 READ_ENGINES：紀錄需依 data_only 的規則轉換，不能直接重播
+    """
+    wb = openpyxl.load_workbook(file_path)
+    journal.replay(file_path, wb)
+    return wb
+
 def ensure_file_exists(file_path: Path, sheet_name: str = "Sheet1"):
     if not file_path.exists():
         wb = openpyxl.Workbook()
         ws = wb.active
         ws.title = sheet_name
-        wb.save(file_path)
+        # 同名舊檔案刪除後留下的日誌不屬於新檔案
+        journal.discard(file_path)
+        atomic_save(wb, file_path)
         logger.info(f"Created new file: {file_path}")
 
 def get_worksheet(file_path: Path, sheet_name: str):
-    wb = openpyxl.load_workbook(file_path)
+    wb = workbook_cache.checkout(file_path)
     if sheet_name not in wb.sheetnames:
-        wb.close()
+        workbook_cache.checkin(file_path, wb)
         raise HTTPException(status_code=404, detail=f"Sheet '{sheet_name}' not found")
     return wb, wb[sheet_name]
 
 def save_workbook(wb, file_path: Path):
-    wb.save(file_path)
+    if JOURNAL_ENABLED:
+        # 只附加變更紀錄，由背景檢查點寫回 xlsx
+        journal.commit(file_path, wb)
+        return
+    records = take_changes(wb)
+    if XML_APPEND_ENABLED and records:
+        base_version = WorkbookCache.file_version(file_path)
+        if append_rows_xml(wb, file_path, records):
+            workbook_cache.publish(file_path, wb, base_version, records)
+            logger.info(f"Appended rows to workbook by XML patch: {file_path}")
+            return
+    atomic_save(wb, file_path)
+    workbook_cache.store(file_path, wb)
     logger.info(f"Saved workbook: {file_path}")
 
+def append_values(ws, values: List[Any]) -> int:
+    """在最後一筆資料之後新增一列(陣列模式)，返回新列號"""
+    next_row = get_real_last_row(ws) + 1
+    write_cells(ws, next_row, enumerate(values, start=1))
+    return next_row
 
-# ============================================================================
-# API 端點
-# ============================================================================
+def require_headers(ws) -> Dict[str, int]:
+    """取得表頭，第一列沒有表頭時返回 400"""
+    headers = get_headers(ws)
+    if not headers:
+        raise HTTPException(
+            status_code=400, 
+            detail="No headers found in row 1. Please ensure the first row contains column names."
+        )
+    return headers
 
-@app.get("/")
-async def root():
+def append_object_values(ws, values: Dict[str, Any]) -> Dict[str, Any]:
+    """依表頭將物件寫入新的一列(物件模式)，返回列號與欄位對應結果"""
+    template = get_column_template(ws, values)
+    
+    # 檢查是否有未知的欄位名稱
+    if template.ignored:
+        logger.warning(f"Unknown columns will be ignored: {template.ignored}")
+    
+    next_row = get_real_last_row(ws) + 1
+    
+    # 根據表頭順序寫入資料，如果沒有提供值，使用 None
+    write_cells(ws, next_row, template.row_cells(values))
+    
     return {
-        "service": "Excel API Server",
-        "status": "running",
-        "version": "3.4.1",
-        "timestamp": datetime.now().isoformat(),
-        "data_directory": str(EXCEL_ROOT_DIR),
-        "lock_timeout": file_lock_manager.default_timeout
+        "row_number": next_row,
+        "matched_columns": list(template.matched),
+        "ignored_columns": list(template.ignored)
     }
 
-@app.get("/api/excel/files")
-async def list_files(token: str = Depends(verify_token)):
-    try:
-        excel_files = []
-        for ext in ['*.xlsx', '*.xls']:
-            excel_files.extend(EXCEL_ROOT_DIR.glob(ext))
-        file_list = [f.name for f in excel_files]
-        file_list.sort()
-        return {"success": True, "files": file_list, "count": len(file_list)}
-    except Exception as e:
-        logger.error(f"Error listing files: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+def has_values(values) -> bool:
+    return any(v not in [None, ""] for v in values)
 
-@app.get("/api/excel/sheets")
-async def list_sheets(file: str, token: str = Depends(verify_token)):
-    file_path = validate_file_path(file)
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-    try:
-        if not file_lock_manager.acquire(str(file_path)):
-            raise HTTPException(status_code=503, detail="File is locked")
-        try:
-            wb = openpyxl.load_workbook(file_path, read_only=True)
-            sheet_names = wb.sheetnames
-            wb.close()
-            return {"success": True, "sheets": sheet_names}
-        finally:
-            file_lock_manager.release(str(file_path))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def append_many_values(ws, rows: List[List[Any]]) -> Dict[str, Any]:
+    """
+    在最後一筆資料之後連續新增多列(陣列模式)，返回新增的列號範圍
+    空白列會在下次清理時被壓縮而改變後續列號，因此先整批驗證再寫入
+    """
+    empty = [i for i, values in enumerate(rows) if not has_values(values)]
+    if empty:
+        raise HTTPException(status_code=400, detail=f"Rows at index {empty} contain no values")
+    
+    first_row = get_real_last_row(ws) + 1
+    for offset, values in enumerate(rows):
+        write_cells(ws, first_row + offset, enumerate(values, start=1))
+    return {"first_row": first_row, "last_row": first_row + len(rows) - 1, "row_count": len(rows)}
 
-@app.get("/api/excel/headers")
-async def get_headers_endpoint(file: str, sheet: str = "Sheet1", token: str = Depends(verify_token)):
+def append_objects_values(ws, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    獲取指定工作表的表頭（第一列）
-    返回欄位名稱列表，供前端下拉選單使用
+    依表頭連續新增多列(物件模式)，表頭只解析一次
+    返回新增的列號範圍，以及含有未知欄位的列(ignored)
     """
-    file_path = validate_file_path(file)
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
+    templates = [get_column_template(ws, values) for values in rows]
+    cells = [template.row_cells(values) for template, values in zip(templates, rows)]
+    empty = [i for i, row_cells in enumerate(cells) if not has_values(value for _, value in row_cells)]
+    if empty:
+        raise HTTPException(status_code=400, detail=f"Rows at index {empty} contain no values for known columns")
     
-    try:
-        if not file_lock_manager.acquire(str(file_path)):
-            raise HTTPException(status_code=503, detail="File is locked")
-        try:
-            wb = openpyxl.load_workbook(file_path, read_only=True)
-            
-            if sheet not in wb.sheetnames:
-                wb.close()
-                raise HTTPException(status_code=404, detail=f"Sheet '{sheet}' not found")
-            
-            ws = wb[sheet]
-            
-            # 讀取第一列作為表頭
-            headers_dict = get_headers(ws)
-            header_names = list(headers_dict.keys())
-            
-            wb.close()
-            
-            return {
-                "success": True, 
-                "headers": header_names,
-                "count": len(header_names)
-            }
+    first_row = get_real_last_row(ws) + 1
+    ignored = []
+    for offset, (template, row_cells) in enumerate(zip(templates, cells)):
+        row_number = first_row + offset
+        write_cells(ws, row_number, row_cells)
+        if template.ignored:
+            ignored.append({"index": offset, "row_number": row_number, "ignored_columns": list(template.ignored)})
+    
+    if ignored:
+        logger.warning(f"Unknown columns ignored in {len(ignored)} row(s)")
+    return {
+        "first_row": first_row,
+        "last_row": first_row + len(rows) - 1,
+        "row_count": len(rows),
+        "ignored": ignored
+    }
+
+
+# ============================================================================
+# XML 新增快速路徑
+# ============================================================================
+
+XML_PATCH_CHUNK_SIZE = 1 << 16
+_SHEET_DATA_END = b"</sheetData>"
+_DIMENSION_RE = re.compile(rb'<dimension ref="([^"]*)"')
+_ROW_NUMBER_RE = re.compile(rb'<row\b[^>]*?\sr="(\d+)"')
+
+class XmlFastPathUnsupported(Exception):
+    """xlsx 含有直接修補或解析 XML 無法處理的內容，改用 openpyxl"""
+
+class _ElementSink:
+    """讓 openpyxl 的儲存格序列化函數把元素交給呼叫端，而非寫入檔案"""
+    def write(self, element):
+        self.element = element
+
+def render_row_xml(ws, row: int, columns) -> bytes:
+    """
+    以 openpyxl 儲存時相同的方式序列化一列新資料，內容與完整儲存後重新載入相同
+    含樣式、註解或超連結的儲存格需要改寫其他部分，不支援
+    """
+    sink = _ElementSink()
+    cells = []
+    for col_idx in sorted(columns):
+        cell = ws._cells.get((row, col_idx))
+        if cell is None or cell._value is None:
+            continue
+        if cell.has_style or cell._comment is not None or cell.hyperlink is not None:
+            raise XmlFastPathUnsupported(f"cell {cell.coordinate} has formatting")
+        etree_write_cell(sink, ws, cell)
+        cells.append(xml_tostring(sink.element))
+    if not cells:
+        return b""
+    return b''.join([f'<row r="{row}">'.encode(), *cells, b"</row>"])
+
+def workbook_package(zin: zipfile.ZipFile):
+    """解析 workbook.xml 及其關聯檔，返回 (workbook 根元素, {關聯 Id: (關聯類型, zip 路徑)})"""
+    package_rels = xml_fromstring(zin.read("_rels/.rels"))
+    workbook_part = next(
+        rel.get("Target").lstrip("/") for rel in package_rels.iter(f"{{{PKG_REL_NS}}}Relationship")
+        if rel.get("Type") == f"{REL_NS}/officeDocument"
+    )
+    base, name = posixpath.split(workbook_part)
+    rels = {}
+    for rel in xml_fromstring(zin.read(posixpath.join(base, "_rels", f"{name}.rels"))).iter(f"{{{PKG_REL_NS}}}Relationship"):
+        target = rel.get("Target")
+        target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base, target))
+        rels[rel.get("Id")] = (rel.get("Type"), target)
+    return xml_fromstring(zin.read(workbook_part)), rels
+
+def sheet_xml_members(zin: zipfile.ZipFile) -> Dict[str, str]:
+    """返回 {工作表名稱: 工作表 XML 路徑}，依活頁簿中的順序(不含圖表工作表)"""
+    workbook, rels = workbook_package(zin)
+    members = {}
+    for sheet in workbook.iter(f"{{{SHEET_MAIN_NS}}}sheet"):
+        rel_type, target = rels[sheet.get(f"{{{REL_NS}}}id")]
+        if rel_type == f"{REL_NS}/worksheet":
+            members[sheet.get("name")] = target
+    return members
+
+def patch_sheet_xml(src, dst, rows_xml: bytes, first_row: int, last_row: int, min_col: int, max_col: int) -> None:
+    """
+    逐段複製工作表 XML，把新的列插入 </sheetData> 之前並更新 <dimension>
+    只保留最後一個 <row> 標籤之後的內容在記憶體中，用來確認新的列確實位於既有資料之後
+    """
+    buf = b""
+    while True:
+        chunk = src.read(XML_PATCH_CHUNK_SIZE)
+        buf += chunk
+        start = buf.find(b"<sheetData")
+        end = buf.find(b">", start) if start >= 0 else -1
+        if end >= 0:
+            break
+        if not chunk:
+            raise XmlFastPathUnsupported("sheetData not found")
+    empty = buf[end - 1:end] == b"/"
+    head = buf[:start]
+    match = _DIMENSION_RE.search(head)
+    if match:
+        bounds = (min_col, first_row, max_col)
+        if not empty:
+            old_min_col, old_min_row, old_max_col, _ = range_boundaries(match.group(1).decode())
+            bounds = (min(old_min_col, min_col), min(old_min_row, first_row), max(old_max_col, max_col))
+        ref = f"{get_column_letter(bounds[0])}{bounds[1]}:{get_column_letter(bounds[2])}{last_row}"
+        head = head[:match.start(1)] + ref.encode() + head[match.end(1):]
+    dst.write(head)
+    if empty:
+        dst.write(b"<sheetData>" + rows_xml + _SHEET_DATA_END + buf[end + 1:])
+        shutil.copyfileobj(src, dst, XML_PATCH_CHUNK_SIZE)
+        return
+    dst.write(buf[start:end + 1])
+    buf = buf[end + 1:]
+    while True:
+        pos = buf.find(_SHEET_DATA_END)
+        if pos >= 0:
+            break
+        chunk = src.read(XML_PATCH_CHUNK_SIZE)
+        if not chunk:
+            raise XmlFastPathUnsupported("</sheetData> not found")
+        # 從最後一個 <row 開始保留(也涵蓋被切斷的結尾標記)，其前的內容直接寫出
+        cut = buf.rfind(b"<row")
+        if cut < 0:
+            cut = max(0, len(buf) - len(_SHEET_DATA_END))
+        dst.write(buf[:cut])
+        buf = buf[cut:] + chunk
+    last = buf.rfind(b"<row", 0, pos)
+    if last >= 0:
+        match = _ROW_NUMBER_RE.match(buf, last)
+        if match is None or int(match.group(1)) >= first_row:
+            raise XmlFastPathUnsupported("new rows overlap existing rows")
+    dst.write(buf[:pos] + rows_xml + buf[pos:])
+    shutil.copyfileobj(src, dst, XML_PATCH_CHUNK_SIZE)
+
+def append_rows_xml(wb, file_path: Path, records: List[Dict[str, Any]]) -> bool:
+    """
+    只新增列的提交直接修補 xlsx：逐段複製目標工作表 XML 並在 </sheetData> 前插入新列，
+    其他 zip 成員內容原樣複製，不需由 openpyxl 重新序列化整個活頁簿
+    變更包含刪除、修改既有的列或無法直接寫入的儲存格時返回 False，由呼叫端改用完整儲存
+    """
+    new_rows: Dict[str, Dict[int, set]] = {}
+    for record in records:
+        if "d" in record:
+            return False
+        new_rows.setdefault(record["s"], {}).setdefault(record["r"], set()).update(col for col, _ in record["c"])
+    
+    patches = {}
+    try:
+        for title, rows in new_rows.items():
+            ws = wb[title]
+            first_row = min(rows)
+            if any(row >= first_row for row, _ in ws._cells if row not in rows):
+                return False
+            rows_xml = b"".join(render_row_xml(ws, row, rows[row]) for row in sorted(rows))
+            if rows_xml:
+                columns = set().union(*rows.values())
+                patches[title] = (rows_xml, first_row, max(rows), min(columns), max(columns))
+        if not patches:
+            return False
+        
+        def write(f):
+            with zipfile.ZipFile(file_path) as zin, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zout:
+                members = sheet_xml_members(zin)
+                targets = {members[title]: patch for title, patch in patches.items()}
+                for info in zin.infolist():
+                    target = targets.get(info.filename)
+                    copied = zipfile.ZipInfo(info.filename, info.date_time)
+                    copied.compress_type = info.compress_type
+                    copied.external_attr = info.external_attr
+                    with zin.open(info) as src, zout.open(copied, "w") as dst:
+                        if target is None:
+                            shutil.copyfileobj(src, dst, XML_PATCH_CHUNK_SIZE)
+                        else:
+                            patch_sheet_xml(src, dst, *target)
+        
+        atomic_write(file_path, write)
+    except (XmlFastPathUnsupported, KeyError, StopIteration, zipfile.BadZipFile) as e:
+        logger.info(f"XML append not applicable for {file_path}, saving with openpyxl: {e}")
+        return False
+    return True
+
+
+# ============================================================================
+# 讀取引擎
+# ============================================================================
+
+_ROW_TAG = f"{{{SHEET_MAIN_NS}}}row"
+_VALUE_TAG = f"{{{SHEET_MAIN_NS}}}v"
+_INLINE_STRING_TAG = f"{{{SHEET_MAIN_NS}}}is"
+_TEXT_TAG = f"{{{SHEET_MAIN_NS}}}t"
+_RUN_TAG = f"{{{SHEET_MAIN_NS}}}r"
+_MERGE_CELL_TAG = f"{{{SHEET_MAIN_NS}}}mergeCell"
+_WORKSHEET_START_RE = re.compile(rb"<worksheet\b[^>]*>")
+# 每批交給解析器的工作表 XML 大小(位元組)
+XML_READ_BATCH_SIZE = 1 << 20
+
+class XmlStyles:
+    """樣式表中與讀取有關的部分：每個樣式索引的數值格式，以及哪些是日期/時間長度格式"""
+    def __init__(self, stylesheet=None):
+        self.date_styles = stylesheet.date_formats if stylesheet is not None else set()
+        self.timedelta_styles = stylesheet.timedelta_formats if stylesheet is not None else set()
+        self._cell_styles = stylesheet.cell_styles if stylesheet is not None else []
+        self._custom_formats = stylesheet.number_formats if stylesheet is not None else []
+
+    def number_format(self, style_id: int) -> str:
+        # 與 openpyxl 的 Cell.number_format 相同：自訂格式的索引從 164 開始
+        fmt_id = self._cell_styles[style_id].numFmtId
+        if fmt_id < BUILTIN_FORMATS_MAX_SIZE:
+            return BUILTIN_FORMATS.get(fmt_id, "General")
+        return self._custom_formats[fmt_id - BUILTIN_FORMATS_MAX_SIZE]
+
+def inline_string_text(element) -> str:
+    """行內字串的純文字(與 openpyxl 的 Text.content 相同)：<t> 之後接上每個 <r> 的 <t>"""
+    parts = []
+    plain = element.find(_TEXT_TAG)
+    if plain is not None and plain.text is not None:
+        parts.append(plain.text)
+    for run in element.iterfind(_RUN_TAG):
+        text = run.findtext(_TEXT_TAG)
+        if text:
+            parts.append(text)
+    return "".join(parts)
+
+def parse_cell_values(rows, state: Dict[str, Any], shared_strings: List[str], styles: XmlStyles, epoch, cells) -> None:
+    """
+    轉換一批 <row> 元素中的儲存格，值的規則與 openpyxl 以 data_only 載入時相同
+    (數值、共用/行內字串、布林、錯誤值、依數值格式轉換日期與時間長度)
+    """
+    row = state["row"]
+    columns = state["columns"]
+    date_styles = styles.date_styles
+    for element in rows:
+        r = element.get("r")
+        row = int(r) if r else row + 1
+        column = 0
+        for cell in element:
+            coordinate = cell.get("r")
+            cell_row = row
+            if coordinate:
+                letters = coordinate.rstrip("0123456789")
+                column = columns.get(letters)
+                if column is None:
+                    column = columns[letters] = column_index_from_string(letters)
+                cell_row = int(coordinate[len(letters):])
+            else:
+                column += 1
+            data_type = cell.get("t", "n")
+            number_format = "General"
+            if data_type == "inlineStr":
+                value = None
+                inline = cell.find(_INLINE_STRING_TAG)
+                if inline is not None:
+                    if len(inline) == 1 and inline[0].tag == _TEXT_TAG:
+                        value = inline[0].text or ""
+                    else:
+                        value = inline_string_text(inline)
+            else:
+                value = cell.findtext(_VALUE_TAG) or None
+                if value is None:
+                    pass
+                elif data_type == "n":
+                    value = _cast_number(value)
+                    style = cell.get("s")
+                    if style and int(style) in date_styles:
+                        style_id = int(style)
+                        try:
+                            value = snapshot_value(from_excel(value, epoch, timedelta=style_id in styles.timedelta_styles))
+                        except (OverflowError, ValueError):
+                            value = "#VALUE!"
+                        if isinstance(value, datetime):
+                            number_format = styles.number_format(style_id)
+                elif data_type == "s":
+                    value = shared_strings[int(value)]
+                elif data_type == "b":
+                    value = bool(int(value))
+                elif data_type == "d":
+                    value = snapshot_value(from_ISO8601(value))
+                    if isinstance(value, datetime):
+                        number_format = styles.number_format(int(cell.get("s") or 0))
+            cells[(cell_row, column)] = SnapshotCell(value, number_format)
+    state["row"] = row
+
+def parse_sheet_snapshot(title: str, src, shared_strings: List[str], styles: XmlStyles, epoch) -> SheetSnapshot:
+    """
+    逐段解析工作表 XML，直接建立快照的儲存格，不建立 openpyxl 的儲存格與樣式物件
+    每次累積到完整的 </row> 為止，包在原本的根元素中交給 C 實作的解析器，記憶體用量與批次大小成正比
+    """
+    buf = b""
+    while True:
+        chunk = src.read(XML_PATCH_CHUNK_SIZE)
+        buf += chunk
+        start = buf.find(b"<sheetData")
+        end = buf.find(b">", start) if start >= 0 else -1
+        if end >= 0:
+            break
+        if not chunk:
+            raise XmlFastPathUnsupported("sheetData not found")
+    root = _WORKSHEET_START_RE.search(buf, 0, start)
+    if root is None:
+        raise XmlFastPathUnsupported("worksheet element not found")
+    root_tag = root.group(0)
+    
+    cells: Dict[Tuple[int, int], SnapshotCell] = {}
+    state = {"row": 0, "columns": {}}
+    
+    def parse_rows(fragment: bytes):
+        sheet_data = xml_fromstring(root_tag + b"<sheetData>" + fragment + b"</sheetData></worksheet>")[0]
+        parse_cell_values(sheet_data, state, shared_strings, styles, epoch, cells)
+    
+    if buf[end - 1:end] == b"/":
+        tail = buf[end + 1:] + src.read()
+    else:
+        buf = buf[end + 1:]
+        while True:
+            pos = buf.find(_SHEET_DATA_END)
+            if pos >= 0:
+                parse_rows(buf[:pos])
+                tail = buf[pos + len(_SHEET_DATA_END):] + src.read()
+                break
+            cut = buf.rfind(b"</row>")
+            if cut >= 0 and len(buf) >= XML_READ_BATCH_SIZE:
+                cut += len(b"</row>")
+                parse_rows(buf[:cut])
+                buf = buf[cut:]
+            chunk = src.read(XML_PATCH_CHUNK_SIZE)
+            if not chunk:
+                raise XmlFastPathUnsupported("</sheetData> not found")
+            buf += chunk
+    
+    # openpyxl 載入時把合併範圍內左上角以外的儲存格換成沒有值的 MergedCell，範圍內缺少的儲存格也會補上
+    for merge_cell in xml_fromstring(root_tag + tail).iter(_MERGE_CELL_TAG):
+        min_col, min_row, max_col, max_row = range_boundaries(merge_cell.get("ref"))
+        for merged_row in range(min_row, max_row + 1):
+            for merged_col in range(min_col, max_col + 1):
+                if (merged_row, merged_col) != (min_row, min_col) or (merged_row, merged_col) not in cells:
+                    cells[(merged_row, merged_col)] = SnapshotCell(None, "General")
+    return SheetSnapshot(title, cells)
+
+def read_workbook_snapshot(file_path: Path) -> WorkbookSnapshot:
+    """直接解析 xlsx 中的工作表、共用字串與樣式 XML，建立唯讀快照(並套用預寫日誌)"""
+    with zipfile.ZipFile(file_path) as zin:
+        workbook, rels = workbook_package(zin)
+        parts = {rel_type: target for rel_type, target in rels.values()}
+        shared_strings = []
+        if f"{REL_NS}/sharedStrings" in parts:
+            with zin.open(parts[f"{REL_NS}/sharedStrings"]) as src:
+                shared_strings = read_string_table(src)
+        styles = XmlStyles()
+        if f"{REL_NS}/styles" in parts:
+            styles = XmlStyles(Stylesheet.from_tree(xml_fromstring(zin.read(parts[f"{REL_NS}/styles"]))))
+        properties = workbook.find(f"{{{SHEET_MAIN_NS}}}workbookPr")
+        date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+        epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+        
+        worksheets = []
+        for title, member in sheet_xml_members(zin).items():
+            with zin.open(member) as src:
+                worksheets.append(parse_sheet_snapshot(title, src, shared_strings, styles, epoch))
+        snapshot = WorkbookSnapshot(worksheets)
+        
+        if journal.has_pending(file_path):
+            seq = 0
+            custom = next(
+                (rel.get("Target").lstrip("/") for rel in xml_fromstring(zin.read("_rels/.rels")).iter(f"{{{PKG_REL_NS}}}Relationship")
+                 if rel.get("Type") == f"{REL_NS}/custom-properties"),
+                None
+            )
+            if custom is not None:
+                props = CustomPropertyList.from_tree(xml_fromstring(zin.read(custom)))
+                if Journal.SEQ_PROPERTY in props.names:
+                    seq = int(props[Journal.SEQ_PROPERTY].value)
+            snapshot = snapshot.apply(journal.records_after(file_path, seq))
+    return snapshot
+
+def load_snapshot_xml(file_path: Path):
+    """xml 讀取引擎，活頁簿結構超出其處理範圍時改用 openpyxl 引擎"""
+    try:
+        return read_workbook_snapshot(file_path)
+    except (XmlFastPathUnsupported, KeyError, StopIteration) as e:
+        logger.info(f"XML read engine not applicable for {file_path}, loading with openpyxl: {e}")
+        return load_values_openpyxl(file_path)
+
+def load_values_openpyxl(file_path: Path):
+    """
+    openpyxl 讀取引擎：以 data_only 載入工作簿
+    預寫日誌中尚未寫回的紀錄與 xml 引擎相同，透過 WorkbookSnapshot.apply() 套用(公式與空字串為 None)
+    """
+    wb = openpyxl.load_workbook(file_path, data_only=True)
+    if not journal.has_pending(file_path):
+        return wb
+    records = journal.records_after(file_path, journal.checkpoint_seq(wb))
+    if not records:
+        return wb
+    return WorkbookSnapshot.from_workbook(wb).apply(records)
+
+# 讀取用途(data_only)的載入方式，兩者的讀取結果相同；xml 引擎不建立儲存格物件，解析速度較快
+READ_ENGINES = {
+    "openpyxl": load_values_openpyxl,
+    "xml": load_snapshot_xml,
+}
+
+READ_ENGINE = os.getenv("READ_ENGINE", "openpyxl")
+if READ_ENGINE not in READ_ENGINES:
+    logger.warning(f"Unknown READ_ENGINE={READ_ENGINE}, falling back to openpyxl")
+    READ_ENGINE = "openpyxl"
+
+
+# ============================================================================
+# 預寫日誌
+# ============================================================================
+
+class Journal:
+    """
+    預寫日誌(JOURNAL_ENABLED=true 時啟用)
+    每個檔案一個旁路日誌 (.<檔名>.wal)，每行一筆 JSON 紀錄：
+    {"q": 序號, "s": 工作表, "r": 列號, "c": [[欄位索引, 值], ...]} 或 {"q": 序號, "s": 工作表, "d": [刪除的列]}
+    提交時只附加紀錄並 fsync，不重寫整個 xlsx；背景執行緒在累積筆數或時間達到門檻時
+    把日誌寫回 xlsx(檢查點)並清空日誌
+    檢查點的序號存於活頁簿自訂屬性，重播時略過已寫入的紀錄，因此任何時間點當機都可安全重播
+    """
+    SEQ_PROPERTY = "ExcelApiJournalSeq"
+
+    def __init__(self, checkpoint_ops: int, checkpoint_seconds: float):
+        self.checkpoint_ops = checkpoint_ops
+        self.checkpoint_seconds = checkpoint_seconds
+        # 每個工作簿已套用的最後序號
+        self._applied: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+        # 尚未寫入檢查點的檔案 -> (紀錄筆數, 第一筆的時間)
+        self._pending: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        logger.info(
+            f"Journal initialized with enabled={JOURNAL_ENABLED}, "
+            f"checkpoint_ops={self.checkpoint_ops}, checkpoint_seconds={self.checkpoint_seconds}s"
+        )
+
+    @staticmethod
+    def log_path(file_path: Path) -> Path:
+        return file_path.parent / f".{file_path.name}.wal"
+
+    @staticmethod
+    def read_records(file_path: Path) -> List[Dict[str, Any]]:
+        try:
+            f = open(Journal.log_path(file_path), encoding="utf-8")
+        except FileNotFoundError:
+            return []
+        records = []
+        with f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 寫入途中當機留下的不完整紀錄，尚未回覆給呼叫端，略過
+                    continue
+        return records
+
+    def checkpoint_seq(self, wb) -> int:
+        props = wb.custom_doc_props
+        if self.SEQ_PROPERTY in props.names:
+            return int(props[self.SEQ_PROPERTY].value)
+        return 0
+
+    def records_after(self, file_path: Path, seq: int) -> List[Dict[str, Any]]:
+        """尚未寫入檢查點(序號大於 seq)的紀錄"""
+        return [record for record in self.read_records(file_path) if record["q"] > seq]
+
+    def replay(self, file_path: Path, wb) -> int:
+        """把序號大於檢查點的紀錄套用到剛載入的工作簿，返回套用的筆數"""
+        seq = self.checkpoint_seq(wb)
+        applied = 0
+        for record in self.records_after(file_path, seq):
+            if record["s"] in wb.sheetnames:
+                ws = wb[record["s"]]
+                if "d" in record:
+                    delete_rows_bulk(ws, record["d"])
+                else:
+                    write_cells(ws, record["r"], record["c"])
+            seq = record["q"]
+            applied += 1
+        # 重播產生的變更紀錄已在日誌中
+        take_changes(wb)
+        self._applied[wb] = seq
+        if applied:
+            logger.info(f"Replayed {applied} journal record(s) for {file_path}")
+        return applied
+
+    def commit(self, file_path: Path, wb) -> None:
+        """日誌模式的 save_workbook：附加並 fsync 變更紀錄後發布新版本(呼叫端需持有檔案鎖定)"""
+        records = take_changes(wb)
+        base_version = WorkbookCache.file_version(file_path)
+        if records:
+            seq = self._applied.get(wb)
+            if seq is None:
+                seq = self.checkpoint_seq(wb)
+            lines = []
+            for record in records:
+                seq += 1
+                record["q"] = seq
+                lines.append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._append(file_path, "".join(lines))
+            self._applied[wb] = seq
+            key = str(file_path)
+            with self._lock:
+                count, since = self._pending.get(key, (0, time.monotonic()))
+                self._pending[key] = (count + len(records), since)
+                due = count + len(records) >= self.checkpoint_ops
+            self._ensure_thread()
+            if due:
+                self._wake.set()
+        workbook_cache.publish(file_path, wb, base_version, records)
+        logger.info(f"Journaled {len(records)} change(s) for {file_path}")
+
+    def _append(self, file_path: Path, data: str) -> None:
+        log_path = self.log_path(file_path)
+        created = not log_path.exists()
+        fd = os.open(log_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o666 & ~_UMASK)
+        try:
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                # 前次寫入途中當機留下不完整的一行，先換行避免與新紀錄黏在一起
+                data = "\n" + data
+            os.write(fd, data.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if created:
+            fsync_directory(file_path.parent)
+
+    def checkpoint(self, file_path: Path) -> bool:
+        """取得檔案的獨佔鎖定，把日誌寫回 xlsx 並刪除日誌；無法取得鎖定時返回 False"""
+        if not file_lock_manager.acquire(str(file_path)):
+            return False
+        try:
+            self._checkpoint_locked(file_path)
         finally:
             file_lock_manager.release(str(file_path))
+        return True
+
+    async def checkpoint_async(self, file_path: Path) -> bool:
+        """
+        checkpoint() 的非同步版本：在事件迴圈上等待獨佔鎖定，只有寫回交給 Excel 執行緒池
+        不會在等待鎖定時佔住執行緒池，讓持有鎖定的寫入者無法執行
+        """
+        if not await file_lock_manager.acquire_async(str(file_path)):
+            return False
+        try:
+            await run_in_excel_executor(self._checkpoint_locked, file_path)
+        finally:
+            file_lock_manager.release(str(file_path))
+        return True
+
+    def _checkpoint_locked(self, file_path: Path) -> None:
+        with self._lock:
+            self._pending.pop(str(file_path), None)
+        log_path = self.log_path(file_path)
+        if not log_path.exists():
+            return
+        if not file_path.exists():
+            log_path.unlink()
+            return
+        wb = workbook_cache.checkout(file_path)
+        seq = self._applied.get(wb)
+        if seq is None:
+            seq = self.checkpoint_seq(wb)
+        props = wb.custom_doc_props
+        props.props = [prop for prop in props.props if prop.name != self.SEQ_PROPERTY]
+        props.append(IntProperty(name=self.SEQ_PROPERTY, value=seq))
+        atomic_save(wb, file_path)
+        # xlsx 已包含序號 seq 之前的紀錄；在刪除日誌前當機也只會在重播時略過這些紀錄
+        log_path.unlink()
+        fsync_directory(file_path.parent)
+        workbook_cache.store(file_path, wb)
+        logger.info(f"Checkpointed {file_path} at journal seq {seq}")
+
+    def has_pending(self, file_path: Path) -> bool:
+        return self.log_path(file_path).exists()
+
+    def discard(self, file_path: Path) -> None:
+        with self._lock:
+            self._pending.pop(str(file_path), None)
+        try:
+            self.log_path(file_path).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="journal-checkpointer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.checkpoint_seconds)
+            self._wake.clear()
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    key for key, (count, since) in self._pending.items()
+                    if count >= self.checkpoint_ops or now - since >= self.checkpoint_seconds
+                ]
+            for key in due:
+                try:
+                    self.checkpoint(Path(key))
+                except Exception as e:
+                    logger.error(f"Checkpoint failed for {key}: {e}")
+
+    def checkpoint_all(self) -> int:
+        """把所有尚未寫入檢查點的檔案寫回 xlsx，返回處理的檔案數"""
+        with self._lock:
+            keys = list(self._pending)
+        for key in keys:
+            self.checkpoint(Path(key))
+        return len(keys)
+
+    def recover(self, directory: Path) -> int:
+        """啟動時把殘留的日誌寫回 xlsx(前次執行可能在檢查點前結束)，返回處理的檔案數"""
+        recovered = 0
+        for log_path in directory.rglob(".*.wal"):
+            file_path = log_path.parent / log_path.name[1:-len(".wal")]
+            if self.checkpoint(file_path):
+                recovered += 1
+        if recovered:
+            logger.info(f"Recovered {recovered} journal(s) under {directory}")
+        return recovered
+
+
+journal = Journal(
+    checkpoint_ops=int(os.getenv("JOURNAL_CHECKPOINT_OPS", "1000")),
+    checkpoint_seconds=float(os.getenv("JOURNAL_CHECKPOINT_SECONDS", "5"))
+)
+
+
+# ============================================================================
+# 群組提交
+# ============================================================================
+
+class _CommitBatch:
+    def __init__(self, loop):
+        self.loop = loop
+        self.items: List[Tuple[str, Any, asyncio.Future]] = []
+        self.full = asyncio.Event()
+        self.task = None
+
+class GroupCommitter:
+    """
+    以檔案為單位的群組提交佇列
+    在時間窗內(或達到批次上限前)到達的變更會套用到同一個工作簿，並只儲存一次
+    """
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[str, _CommitBatch] = {}
+        logger.info(f"GroupCommitter initialized with window={self.window}s, max_batch={self.max_batch}")
+    
+    async def submit(self, file_path: Path, sheet_name: str, mutation):
+        """
+        提交一個變更 mutation(ws)，等待所屬批次儲存完成後返回其結果
+        每個變更的例外只會回報給提交該變更的呼叫端
+        """
+        loop = asyncio.get_running_loop()
+        key = str(file_path)
+        batch = self._pending.get(key)
+        if batch is None or batch.loop is not loop:
+            batch = _CommitBatch(loop)
+            self._pending[key] = batch
+            batch.task = loop.create_task(self._run(key, file_path, batch))
+        
+        future = loop.create_future()
+        batch.items.append((sheet_name, mutation, future))
+        if len(batch.items) >= self.max_batch:
+            self._close(key, batch)
+        return await future
+    
+    def _close(self, key: str, batch: _CommitBatch):
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        batch.full.set()
+    
+    async def _run(self, key: str, file_path: Path, batch: _CommitBatch):
+        try:
+            await asyncio.wait_for(batch.full.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        self._close(key, batch)
+        
+        items = [(sheet_name, mutation, future) for sheet_name, mutation, future in batch.items if not future.done()]
+        if not items:
+            return
+        
+        try:
+            if not await file_lock_manager.acquire_async(str(file_path)):
+                raise HTTPException(status_code=503, detail="File is locked")
+            try:
+                outcomes = await run_in_excel_executor(
+                    self._commit, file_path, [(sheet_name, mutation) for sheet_name, mutation, _ in items]
+                )
+            finally:
+                file_lock_manager.release(str(file_path))
+        except Exception as e:
+            outcomes = [(None, e)] * len(items)
+        
+        for (_, _, future), (result, error) in zip(items, outcomes):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    
+    def _apply(self, wb, items: List[Tuple[str, Any]]) -> Tuple[List[Tuple[Any, Optional[Exception]]], bool]:
+        """
+        將變更依序套用到工作簿，返回 (每個變更的 (結果, 例外), 是否可能留下部分寫入)
+        變更應在寫入前以 HTTPException 回報驗證錯誤；其他例外可能發生在寫入途中
+        """
+        cleaned_sheets = set()
+        outcomes = []
+        tainted = False
+        for sheet_name, mutation in items:
+            try:
+                if sheet_name not in wb.sheetnames:
+                    raise HTTPException(status_code=404, detail=f"Sheet '{sheet_name}' not found")
+                ws = wb[sheet_name]
+                if sheet_name not in cleaned_sheets:
+                    cleanup_all_empty_rows(ws)
+                    cleaned_sheets.add(sheet_name)
+                outcomes.append((mutation(ws), None))
+            except Exception as e:
+                outcomes.append((None, e))
+                tainted = tainted or not isinstance(e, HTTPException)
+        return outcomes, tainted
+    
+    def _commit(self, file_path: Path, items: List[Tuple[str, Any]]) -> List[Tuple[Any, Optional[Exception]]]:
+        """在已持有檔案鎖定的情況下套用整批變更並儲存一次，返回每個變更的 (結果, 例外)"""
+        ensure_file_exists(file_path, items[0][0])
+        wb = workbook_cache.checkout(file_path)
+        outcomes, tainted = self._apply(wb, items)
+        
+        while tainted:
+            # 失敗的變更可能已寫入部分儲存格：捨棄此工作簿，重新載入後只重做成功的變更
+            pending = [i for i, (_, error) in enumerate(outcomes) if error is None]
+            logger.warning(f"Group commit for {file_path}: retrying {len(pending)} mutation(s) after a failed one")
+            wb = workbook_cache.checkout(file_path)
+            retried, tainted = self._apply(wb, [items[i] for i in pending])
+            for i, outcome in zip(pending, retried):
+                outcomes[i] = outcome
+        
+        applied = sum(1 for _, error in outcomes if error is None)
+        if applied:
+            save_workbook(wb, file_path)
+            logger.info(f"Group commit for {file_path}: {applied} mutation(s) in one save")
+        return outcomes
+
+
+group_committer = GroupCommitter(
+    window=float(os.getenv("GROUP_COMMIT_WINDOW_MS", "5")) / 1000,
+    max_batch=int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
+)
+
+
+# ============================================================================
+# API 端點
+# ============================================================================
+
+@app.get("/")
+async def root():
+    return {
+        "service": "Excel API Server",
+        "status": "running",
+        "version": "3.4.1",
+        "timestamp": datetime.now().isoformat(),
+        "data_directory": str(EXCEL_ROOT_DIR),
+        "lock_timeout": file_lock_manager.default_timeout,
+        "lock_stats": file_lock_manager.stats
+    }
+
+@app.get("/api/excel/files")
+async def list_files(token: str = Depends(verify_token)):
+    try:
+        excel_files = []
+        for ext in ['*.xlsx', '*.xls']:
+            excel_files.extend(EXCEL_ROOT_DIR.glob(ext))
+        file_list = [f.name for f in excel_files]
+        file_list.sort()
+        return {"success": True, "files": file_list, "count": len(file_list)}
+    except Exception as e:
+        logger.error(f"Error listing files: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def load_sheet_names(file_path: Path) -> List[str]:
+    # 讀取者只使用 data_only 快取項目：寫入者取出的是另一份工作簿，讀取期間不會被修改
+    wb = workbook_cache.get(file_path, data_only=True)
+    return wb.sheetnames
+
+@app.get("/api/excel/sheets")
+async def list_sheets(file: str, token: str = Depends(verify_token)):
+    file_path = validate_file_path(file)
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        # 儲存為原子性取代，讀取不需等待寫入者(Windows 除外，見 READER_LOCK_REQUIRED)
+        async with reader_lock(file_path):
+            sheet_names = await run_in_excel_executor(load_sheet_names, file_path)
+        return {"success": True, "sheets": sheet_names}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def load_header_names(file_path: Path, sheet: str) -> List[str]:
+    wb = workbook_cache.get(file_path, data_only=True)
+    
+    if sheet not in wb.sheetnames:
+        raise HTTPException(status_code=404, detail=f"Sheet '{sheet}' not found")
+    
+    ws = wb[sheet]
+    
+    # 讀取第一列作為表頭
+    headers_dict = get_headers(ws)
+    return list(headers_dict.keys())
+
+@app.get("/api/excel/headers")
+async def get_headers_endpoint(file: str, sheet: str = "Sheet1", token: str = Depends(verify_token)):
+    """
+    獲取指定工作表的表頭（第一列）
+    返回欄位名稱列表，供前端下拉選單使用
+    """
+    file_path = validate_file_path(file)
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    try:
+        async with reader_lock(file_path):
+            header_names = await run_in_excel_executor(load_header_names, file_path, sheet)
+        
+        return {
+            "success": True, 
+            "headers": header_names,
+            "count": len(header_names)
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -345,22 +2119,10 @@ async def append_row(request: AppendRequest, token: str = Depends(verify_token))
     """新增一列到 Excel 檔案(陣列模式)"""
     file_path = validate_file_path(request.file)
     try:
-        if not file_lock_manager.acquire(str(file_path)):
-            raise HTTPException(status_code=503, detail="File is locked")
-        try:
-            ensure_file_exists(file_path, request.sheet)
-            wb, ws = get_worksheet(file_path, request.sheet)
-            
-            cleanup_all_empty_rows(ws)
-            next_row = get_real_last_row(ws) + 1
-            
-            for col_idx, value in enumerate(request.values, start=1):
-                ws.cell(row=next_row, column=col_idx, value=value)
-            
-            save_workbook(wb, file_path)
-            return {"success": True, "row_number": next_row}
-        finally:
-            file_lock_manager.release(str(file_path))
+        next_row = await group_committer.submit(
+            file_path, request.sheet, lambda ws: append_values(ws, request.values)
+        )
+        return {"success": True, "row_number": next_row}
     except Exception as e:
         logger.error(f"Error appending row: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -373,93 +2135,640 @@ async def append_row_object(request: AppendObjectRequest, token: str = Depends(v
     """
     file_path = validate_file_path(request.file)
     try:
-        if not file_lock_manager.acquire(str(file_path)):
-            raise HTTPException(status_code=503, detail="File is locked")
-        try:
-            ensure_file_exists(file_path, request.sheet)
-            wb, ws = get_worksheet(file_path, request.sheet)
-            
-            # 獲取表頭
-            headers = get_headers(ws)
-            if not headers:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="No headers found in row 1. Please ensure the first row contains column names."
-                )
-            
-            # 檢查是否有未知的欄位名稱
-            unknown_columns = [col for col in request.values.keys() if col not in headers]
-            if unknown_columns:
-                logger.warning(f"Unknown columns will be ignored: {unknown_columns}")
-            
-            # 按照表頭順序建立值陣列
-            cleanup_all_empty_rows(ws)
-            next_row = get_real_last_row(ws) + 1
-            
-            # 根據表頭順序寫入資料
-            for col_name, col_idx in headers.items():
-                value = request.values.get(col_name, None)  # 如果沒有提供值，使用 None
-                ws.cell(row=next_row, column=col_idx, value=value)
-            
-            save_workbook(wb, file_path)
-            
-            return {
-                "success": True, 
-                "row_number": next_row,
-                "matched_columns": [col for col in request.values.keys() if col in headers],
-                "ignored_columns": unknown_columns
-            }
-        finally:
-            file_lock_manager.release(str(file_path))
+        result = await group_committer.submit(
+            file_path, request.sheet, lambda ws: append_object_values(ws, request.values)
+        )
+        return {"success": True, **result}
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error appending row (object mode): {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def build_key_map(ws, col_idx: int) -> Dict[str, List[int]]:
+    """建立 {正規化值: [列號, ...]} 的對照表；啟用查找索引時直接複製索引，否則掃描一次"""
+    if LOOKUP_INDEX_ENABLED:
+        return {key: list(rows) for key, rows in get_lookup_index(ws, col_idx).items()}
+    key_map: Dict[str, List[int]] = {}
+    for row_idx in range(2, get_real_last_row(ws) + 1):
+        value = peek_value(ws, row_idx, col_idx)
+        if value is not None:
+            key_map.setdefault(normalize_lookup_value(value), []).append(row_idx)
+    return key_map
+
+def upsert_records(ws, key_column: str, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    依主鍵欄位更新已存在的列(所有符合的列)，不存在時新增一列
+    主鍵對照表只建立一次；只寫入值有變動的儲存格，沒有變動的記錄計為 unchanged
+    """
+    headers = require_headers(ws)
+    if key_column not in headers:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Key column '{key_column}' not found in headers. Available columns: {list(headers.keys())}"
+        )
+    missing_keys = [i for i, record in enumerate(records) if record.get(key_column) in [None, ""]]
+    if missing_keys:
+        raise HTTPException(status_code=400, detail=f"Records at index {missing_keys} have no value for key column '{key_column}'")
+    
+    key_map = build_key_map(ws, headers[key_column])
+    next_row = get_real_last_row(ws) + 1
+    inserted = updated = unchanged = 0
+    ignored = []
+    
+    for i, record in enumerate(records):
+        cells = [(headers[col_name], value) for col_name, value in record.items() if col_name in headers]
+        unknown_columns = [col for col in record.keys() if col not in headers]
+        if unknown_columns:
+            ignored.append({"index": i, "ignored_columns": unknown_columns})
+        
+        key = normalize_lookup_value(record[key_column])
+        rows = key_map.get(key)
+        if rows is None:
+            write_cells(ws, next_row, cells)
+            key_map[key] = [next_row]
+            next_row += 1
+            inserted += 1
+            continue
+        
+        changed = False
+        for row_idx in rows:
+            # 與 update_advanced 相同，None 不會覆寫既有的值
+            changes = [
+                (col_idx, value) for col_idx, value in cells
+                if value is not None and peek_value(ws, row_idx, col_idx) != value
+            ]
+            if changes:
+                write_cells(ws, row_idx, changes)
+                changed = True
+        if changed:
+            updated += 1
+        else:
+            unchanged += 1
+    
+    logger.info(f"Upsert on '{ws.title}' by {key_column}: {inserted} inserted, {updated} updated, {unchanged} unchanged")
+    return {"inserted": inserted, "updated": updated, "unchanged": unchanged, "ignored": ignored}
+
+@app.post("/api/excel/upsert")
+async def upsert_rows(request: UpsertRequest, token: str = Depends(verify_token)):
+    """
+    依主鍵欄位批次更新或新增記錄
+    整批在同一次鎖定、載入與儲存中完成，返回新增、更新與未變動的筆數
+    """
+    file_path = validate_file_path(request.file)
+    try:
+        result = await group_committer.submit(
+            file_path, request.sheet, lambda ws: upsert_records(ws, request.key_column, request.records)
+        )
+        return {"success": True, **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error upserting rows: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/excel/append_many")
+async def append_rows(request: AppendManyRequest, token: str = Depends(verify_token)):
+    """
+    一次新增多列(陣列模式)
+    整批在同一次鎖定、載入與儲存中完成，返回新增的列號範圍
+    """
+    file_path = validate_file_path(request.file)
+    try:
+        result = await group_committer.submit(
+            file_path, request.sheet, lambda ws: append_many_values(ws, request.rows)
+        )
+        return {"success": True, **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error appending rows: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/excel/append_objects")
+async def append_rows_object(request: AppendObjectsRequest, token: str = Depends(verify_token)):
+    """
+    一次新增多列(物件模式)
+    根據欄位名稱對應欄位位置，返回新增的列號範圍與每列被忽略的欄位
+    """
+    file_path = validate_file_path(request.file)
+    try:
+        result = await group_committer.submit(
+            file_path, request.sheet, lambda ws: append_objects_values(ws, request.rows)
+        )
+        return {"success": True, **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error appending rows (object mode): {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def format_cell_value(cell):
+    """將儲存格值轉換為 JSON 輸出格式，日期依數值格式決定是否包含時間"""
+    if cell is None:
+        return None
+    val = cell.value
+    if isinstance(val, datetime):
+        fmt = cell.number_format if cell.number_format else ""
+        if any(char in fmt.lower() for char in ['h', 's']) or (':' in fmt):
+            return val.strftime('%Y-%m-%d %H:%M:%S')
+        return val.strftime('%Y-%m-%d')
+    return val
+
+def parse_range(cell_range: str) -> Tuple[Optional[int], Optional[int], Optional[int], Optional[int]]:
+    """解析 A1 格式的範圍，返回 (min_col, min_row, max_col, max_row)；整欄或整列範圍的另一維為 None"""
+    try:
+        return range_boundaries(cell_range)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid range '{cell_range}': {e}")
+
+def resolve_read_bounds(ws, cell_range: Optional[str]) -> Tuple[int, int, int, int]:
+    """
+    返回讀取範圍 (min_col, min_row, max_col, max_row)，未指定時為整個工作表
+    與 ws.iter_rows() 及 /read_stream 相同，一律從 A1 開始，資料不從 A 欄開始時前面的欄位返回 None
+    """
+    if not cell_range:
+        return 1, 1, ws.max_column, ws.max_row
+    min_col, min_row, max_col, max_row = parse_range(cell_range)
+    return (
+        min_col or 1,
+        min_row or 1,
+        max_col or ws.max_column,
+        max_row or ws.max_row,
+    )
+
+WHERE_COMPARISONS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+WHERE_OPERATORS = {"eq", "ne", "in", "prefix", "is_null", "not_null", *WHERE_COMPARISONS}
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def comparable_operand(cell_value, operand, operand_date):
+    """依儲存格的型別選擇可比較的運算元，型別不相容時返回 None(視為不符合)"""
+    if isinstance(cell_value, datetime):
+        return operand_date
+    if is_number(cell_value):
+        if is_number(operand):
+            return operand
+        try:
+            return float(operand)
+        except (TypeError, ValueError):
+            return None
+    if isinstance(cell_value, str) and isinstance(operand, str):
+        return operand
+    return None
+
+def compile_where(clause: WhereClause, headers: Dict[str, int]):
+    """
+    將 where 條件編譯為 predicate(ws, row_idx) -> bool
+    直接比對原始儲存格值，不符合的列不需格式化
+    """
+    if clause.and_ is not None or clause.or_ is not None:
+        if clause.column is not None or (clause.and_ is not None and clause.or_ is not None):
+            raise HTTPException(status_code=400, detail="A where clause must be either a condition or a single 'and'/'or' group")
+        children = [compile_where(child, headers) for child in (clause.and_ if clause.and_ is not None else clause.or_)]
+        combine = all if clause.and_ is not None else any
+        return lambda ws, row_idx: combine(predicate(ws, row_idx) for predicate in children)
+    
+    if clause.column is None:
+        raise HTTPException(status_code=400, detail="A where condition requires 'column'")
+    if clause.column not in headers:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Where column '{clause.column}' not found in headers. Available columns: {list(headers.keys())}"
+        )
+    if clause.op not in WHERE_OPERATORS:
+        raise HTTPException(status_code=400, detail=f"Unsupported where operator '{clause.op}'. Supported: {sorted(WHERE_OPERATORS)}")
+    
+    col_idx = headers[clause.column]
+    op = clause.op
+    value = clause.value
+    
+    if op in ("eq", "ne"):
+        key = normalize_lookup_value(value)
+        if op == "eq":
+            return lambda ws, row_idx: normalize_lookup_value(peek_value(ws, row_idx, col_idx)) == key
+        return lambda ws, row_idx: normalize_lookup_value(peek_value(ws, row_idx, col_idx)) != key
+    if op == "in":
+        if not isinstance(value, list):
+            raise HTTPException(status_code=400, detail="The 'in' operator requires a list value")
+        keys = {normalize_lookup_value(v) for v in value}
+        return lambda ws, row_idx: normalize_lookup_value(peek_value(ws, row_idx, col_idx)) in keys
+    if op == "prefix":
+        prefix = str(value)
+        
+        def has_prefix(ws, row_idx):
+            cell_value = peek_value(ws, row_idx, col_idx)
+            return cell_value is not None and str(cell_value).startswith(prefix)
+        return has_prefix
+    if op == "is_null":
+        return lambda ws, row_idx: peek_value(ws, row_idx, col_idx) in [None, ""]
+    if op == "not_null":
+        return lambda ws, row_idx: peek_value(ws, row_idx, col_idx) not in [None, ""]
+    
+    compare = WHERE_COMPARISONS[op]
+    operand_date = None
+    if isinstance(value, str):
+        try:
+            operand_date = datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        if operand_date is not None and operand_date.tzinfo is not None:
+            # Excel 的日期不含時區：帶時差的運算元換算為 UTC 後去除時區，與儲存格值比較
+            operand_date = operand_date.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    def predicate(ws, row_idx):
+        cell_value = peek_value(ws, row_idx, col_idx)
+        other = comparable_operand(cell_value, value, operand_date)
+        return other is not None and compare(cell_value, other)
+    return predicate
+
+def where_candidate_rows(ws, clause: WhereClause, headers: Dict[str, int]) -> Optional[set]:
+    """
+    以查找索引求出可能符合 where 的列號集合(eq/in 條件，and 取交集、or 取聯集)
+    無法使用索引時返回 None，表示需要逐列掃描
+    """
+    if not LOOKUP_INDEX_ENABLED:
+        return None
+    if clause.and_ is not None:
+        candidates = [rows for rows in (where_candidate_rows(ws, child, headers) for child in clause.and_) if rows is not None]
+        return set.intersection(*candidates) if candidates else None
+    if clause.or_ is not None:
+        candidates = [where_candidate_rows(ws, child, headers) for child in clause.or_]
+        return None if any(rows is None for rows in candidates) else set().union(*candidates)
+    
+    # 索引不含空白儲存格，比對 None 時只能掃描
+    if clause.op == "eq" and clause.value is not None:
+        values = [clause.value]
+    elif clause.op == "in" and None not in clause.value:
+        values = clause.value
+    else:
+        return None
+    index = get_lookup_index(ws, headers[clause.column])
+    rows = set()
+    for value in values:
+        rows.update(index.get(normalize_lookup_value(value), []))
+    return rows
+
+def resolve_read_columns(headers: Optional[Dict[str, int]], columns: Optional[List[str]], min_col: int, max_col: int) -> List[int]:
+    """
+    返回要讀取的欄位索引；指定 columns 時依表頭名稱對應，並保留指定順序
+    欄位需位於讀取範圍的欄內(range 指定欄時)，範圍外的欄位返回 400，不會被略過或讀取
+    """
+    if columns is None:
+        return list(range(min_col, max_col + 1))
+    missing = [name for name in columns if name not in headers]
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Columns {missing} not found in headers. Available columns: {list(headers.keys())}"
+        )
+    outside = [name for name in columns if not min_col <= headers[name] <= max_col]
+    if outside:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Columns {outside} are outside the requested range "
+                   f"({get_column_letter(min_col)}:{get_column_letter(max_col)})"
+        )
+    return [headers[name] for name in columns]
+
+def iter_sheet_rows(ws, col_indexes: List[int], min_row: int, max_row: int,
+                    row_numbers: Optional[List[int]] = None, predicate=None):
+    """
+    逐列產出 (列號, 格式化後的值)，只讀取 col_indexes 指定的欄位並略過完全空白的列
+    row_numbers 為候選列號(已排序)，predicate 篩選資料列，表頭列一律保留
+    """
+    if row_numbers is None:
+        row_numbers = range(min_row, max_row + 1)
+    for row_idx in row_numbers:
+        if row_idx < min_row or row_idx > max_row:
+            continue
+        if predicate is not None and row_idx > 1 and not predicate(ws, row_idx):
+            continue
+        row_values = [format_cell_value(peek_cell(ws, row_idx, col_idx)) for col_idx in col_indexes]
+        if any(v not in [None, ""] for v in row_values):
+            yield row_idx, row_values
+
+def version_token(version: Optional[Tuple[int, int, int]]) -> str:
+    return "-".join(str(part) for part in version) if version else ""
+
+def encode_read_cursor(version: str, request: ReadRequest, next_row: int) -> str:
+    payload = {"v": version, "s": request.sheet, "r": request.range, "n": next_row}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_read_cursor(cursor: str, version: str, request: ReadRequest) -> int:
+    """驗證分頁游標並返回下一個要讀取的列號；檔案已變更時返回 409"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        next_row = int(payload["n"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if payload.get("s") != request.sheet or payload.get("r") != request.range:
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested sheet or range")
+    if payload.get("v") != version:
+        raise HTTPException(status_code=409, detail="File has changed since the cursor was issued. Please restart reading.")
+    return next_row
+
+READ_FORMATS = ("rows", "records", "columnar", "msgpack")
+
+def column_names(ws, col_indexes: List[int]) -> List[str]:
+    """以表頭作為欄位名稱，表頭空白時使用欄位字母"""
+    names = []
+    for col_idx in col_indexes:
+        header_value = peek_value(ws, 1, col_idx)
+        names.append(str(header_value) if header_value not in [None, ""] else get_column_letter(col_idx))
+    return names
+
+def encode_column(values: List[Any]):
+    """
+    將一欄的值編碼為陣列；字串欄位有重複值時改用字典編碼
+    {"dictionary": [不重複的值], "indices": [每列對應的索引，空白為 null]}
+    """
+    dictionary: Dict[str, int] = {}
+    for value in values:
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            return values
+        dictionary.setdefault(value, len(dictionary))
+    if len(dictionary) >= sum(value is not None for value in values):
+        return values
+    return {
+        "dictionary": list(dictionary),
+        "indices": [None if value is None else dictionary[value] for value in values],
+    }
+
+def shape_read_result(names: Optional[List[str]], rows: List[List[Any]], read_format: str) -> Dict[str, Any]:
+    """將讀取到的列轉換為指定的回應格式"""
+    if read_format == "records":
+        return {"data": [dict(zip(names, row)) for row in rows]}
+    if read_format == "columnar":
+        return {"columns": names, "data": [encode_column(list(values)) for values in zip(*rows)] if rows else [[] for _ in names]}
+    if read_format == "msgpack":
+        return {"columns": names, "rows": rows}
+    return {"data": rows}
+
+def read_sheet_data(file_path: Path, request: ReadRequest) -> Dict[str, Any]:
+    if request.format not in READ_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format '{request.format}'. Supported: {list(READ_FORMATS)}")
+    if request.format == "msgpack" and msgpack is None:
+        raise HTTPException(status_code=400, detail="The msgpack format requires the 'msgpack' package")
+    if request.engine is not None and request.engine not in READ_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Invalid engine '{request.engine}'. Supported: {list(READ_ENGINES)}")
+    
+    version, wb = workbook_cache.get_versioned(file_path, data_only=True, engine=request.engine)
+    if request.sheet not in wb.sheetnames:
+        raise HTTPException(status_code=404, detail=f"Sheet '{request.sheet}' not found")
+    ws = wb[request.sheet]
+    
+    min_col, min_row, max_col, max_row = resolve_read_bounds(ws, request.range)
+    headers = get_headers(ws) if request.where is not None or request.columns is not None else None
+    col_indexes = resolve_read_columns(headers, request.columns, min_col, max_col)
+    if request.format != "rows":
+        # 其他格式以表頭作為欄位名稱，表頭列不列入資料
+        min_row = max(min_row, 2)
+    paged = request.offset is not None or request.limit is not None or request.cursor is not None
+    version = version_token(version) if paged else None
+    
+    row_numbers = predicate = None
+    if request.where is not None:
+        predicate = compile_where(request.where, headers)
+        candidates = where_candidate_rows(ws, request.where, headers)
+        if candidates is not None:
+            row_numbers = sorted(candidates | {1})
+    
+    skip = request.offset or 0
+    if request.cursor:
+        min_row = max(min_row, decode_read_cursor(request.cursor, version, request))
+        skip = 0
+    
+    data = []
+    next_row = None
+    for row_idx, row_values in iter_sheet_rows(ws, col_indexes, min_row, max_row, row_numbers, predicate):
+        if skip:
+            skip -= 1
+            continue
+        if request.limit is not None and len(data) >= request.limit:
+            # 已填滿一頁，記下下一筆資料的位置後立即停止
+            next_row = row_idx
+            break
+        data.append(row_values)
+    
+    names = column_names(ws, col_indexes) if request.format != "rows" else None
+    result = shape_read_result(names, data, request.format)
+    result["row_count"] = len(data)
+    if paged:
+        result["has_more"] = next_row is not None
+        result["next_cursor"] = encode_read_cursor(version, request, next_row) if next_row is not None else None
+    return result
+
 @app.post("/api/excel/read")
 async def read_rows(request: ReadRequest, token: str = Depends(verify_token)):
     file_path = validate_file_path(request.file)
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
     try:
-        if not file_lock_manager.acquire(str(file_path)):
-            raise HTTPException(status_code=503, detail="File is locked")
-        try:
-            wb = openpyxl.load_workbook(file_path, data_only=True)
-            if request.sheet not in wb.sheetnames:
-                wb.close()
-                raise HTTPException(status_code=404, detail=f"Sheet '{request.sheet}' not found")
-            ws = wb[request.sheet]
-            
-            data = []
-            rows = ws[request.range] if request.range else ws.rows
-            
-            for row in rows:
-                row_values = []
-                for cell in row:
-                    val = cell.value
-                    if isinstance(val, datetime):
-                        fmt = cell.number_format if cell.number_format else ""
-                        if any(char in fmt.lower() for char in ['h', 's']) or (':' in fmt):
-                            row_values.append(val.strftime('%Y-%m-%d %H:%M:%S'))
-                        else:
-                            row_values.append(val.strftime('%Y-%m-%d'))
-                    else:
-                        row_values.append(val)
-                
-                if any(v not in [None, ""] for v in row_values):
-                    data.append(row_values)
-            
-            return {"success": True, "data": data, "row_count": len(data)}
-        finally:
-            file_lock_manager.release(str(file_path))
+        # 儲存為原子性取代，讀取不需等待寫入者(Windows 除外，見 READER_LOCK_REQUIRED)
+        async with reader_lock(file_path):
+            result = await run_in_excel_executor(read_sheet_data, file_path, request)
+        if request.format == "msgpack":
+            return Response(
+                content=msgpack.packb({"success": True, **result}, default=str),
+                media_type="application/x-msgpack"
+            )
+        return {"success": True, **result}
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error reading file: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def resolve_target_rows(ws, request, action: str) -> List[int]:
+    """依 row 或 lookup_column/lookup_value 確定要處理的列號(update_advanced 與 delete_advanced 共用)"""
+    target_rows = []
+    if request.row is not None:
+        # 方式1: 直接指定列號
+        target_row = request.row
+        if target_row < 1 or target_row > ws.max_row:
+            raise HTTPException(status_code=400, detail=f"Invalid row number: {target_row}")
+        # 🔒 保護標題列
+        if target_row == 1:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Cannot {action} header row (row 1). Data rows start from row 2."
+            )
+        target_rows = [target_row]
+    elif request.lookup_column and request.lookup_value:
+        # 方式2: 透過 Lookup 查找所有符合條件的記錄
+        matched_rows = find_all_rows_by_lookup(ws, request.lookup_column, request.lookup_value)
+        if not matched_rows:
+            raise HTTPException(
+                status_code=404, 
+                detail=f"No row found where {request.lookup_column} = {request.lookup_value}"
+            )
+        # 🆕 根據 process_all 決定處理哪些記錄
+        if request.process_all:
+            target_rows = matched_rows  # 處理所有匹配記錄
+        else:
+            target_rows = [matched_rows[0]]  # 只處理第一筆
+            logger.info(f"Process mode: First match only (row {matched_rows[0]})")
+    else:
+        raise HTTPException(
+            status_code=400, 
+            detail="Must provide either 'row' or both 'lookup_column' and 'lookup_value'"
+        )
+
+    return target_rows
+
+# 串流讀取時每次從執行緒池取回的列數
+STREAM_CHUNK_ROWS = 1000
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+def open_sheet_stream(file_path: Path, sheet: str):
+    """以 read_only 模式開啟工作表，儲存格在迭代時才從檔案逐列解析"""
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    if sheet not in wb.sheetnames:
+        wb.close()
+        raise HTTPException(status_code=404, detail=f"Sheet '{sheet}' not found")
+    return wb, wb[sheet]
+
+def iter_stream_chunks(ws, bounds: Optional[Tuple[Optional[int], ...]]):
+    """
+    逐列讀取並格式化，每 STREAM_CHUNK_ROWS 列產出一批，記憶體用量與工作表大小無關
+    bounds 為 parse_range() 的結果；範圍需在開始回應前驗證，串流開始後已無法返回錯誤狀態
+    """
+    if bounds:
+        min_col, min_row, max_col, max_row = bounds
+        rows = ws.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col)
+    else:
+        rows = ws.iter_rows()
+    
+    chunk = []
+    for row in rows:
+        row_values = [format_cell_value(cell) for cell in row]
+        if any(v not in [None, ""] for v in row_values):
+            chunk.append(row_values)
+            if len(chunk) >= STREAM_CHUNK_ROWS:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+async def stream_sheet_rows(chunks, stream_format: str):
+    """將列批次編碼為 NDJSON 或 JSON 陣列片段；每一批都在 Excel 執行緒池中解析"""
+    first = True
+    if stream_format == "json":
+        yield "["
+    while True:
+        chunk = await run_in_excel_executor(next, chunks, None)
+        if chunk is None:
+            break
+        encoded = [json.dumps(row, ensure_ascii=False, default=str) for row in chunk]
+        if stream_format == "json":
+            yield ("" if first else ",") + ",".join(encoded)
+        else:
+            yield "\n".join(encoded) + "\n"
+        first = False
+    if stream_format == "json":
+        yield "]"
+
+@app.post("/api/excel/read_stream")
+async def read_rows_stream(request: ReadStreamRequest, token: str = Depends(verify_token)):
+    """
+    串流讀取工作表(NDJSON 或分段 JSON 陣列)
+    以 read_only 模式逐列解析並分批送出，適合數十萬列的大型工作表
+    """
+    if request.stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid stream_format '{request.stream_format}'. Supported: {list(STREAM_MEDIA_TYPES.keys())}"
+        )
+    bounds = parse_range(request.range) if request.range else None
+    file_path = validate_file_path(request.file)
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # 開啟的檔案在串流期間保持開啟，寫入者以 os.replace 取代時不影響這份版本
+    # Windows 無法取代開啟中的檔案，串流期間持有共用鎖定(見 READER_LOCK_REQUIRED)
+    try:
+        if journal.has_pending(file_path) and not await journal.checkpoint_async(file_path):
+            # 串流直接讀取 xlsx，需先把日誌中的變更寫回(在取得共用鎖定之前)，否則會讀到舊版本
+            raise HTTPException(status_code=503, detail="File is locked")
+        await acquire_reader_lock(file_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error opening stream: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        wb, ws = await run_in_excel_executor(open_sheet_stream, file_path, request.sheet)
+    except HTTPException:
+        release_reader_lock(file_path)
+        raise
+    except Exception as e:
+        release_reader_lock(file_path)
+        logger.error(f"Error opening stream: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def finish():
+        # 串流結束(或用戶端中斷)後才關閉檔案並釋放共用鎖定
+        try:
+            await run_in_excel_executor(wb.close)
+        finally:
+            release_reader_lock(file_path)
+    
+    return StreamingResponse(
+        stream_sheet_rows(iter_stream_chunks(ws, bounds), request.stream_format),
+        media_type=STREAM_MEDIA_TYPES[request.stream_format],
+        background=BackgroundTask(finish)
+    )
+
+def apply_update_advanced(file_path: Path, request: UpdateAdvancedRequest) -> Dict[str, Any]:
+    """執行進階更新並儲存(呼叫端需已持有檔案鎖定)"""
+    wb, ws = get_worksheet(file_path, request.sheet)
+
+    try:
+        target_rows = resolve_target_rows(ws, request, "update")
+    except HTTPException:
+        # 尚未修改工作簿，歸還快取供下一個請求使用
+        workbook_cache.checkin(file_path, wb)
+        raise
+
+    # 獲取表頭
+    headers = get_headers(ws)
+
+    # 處理單筆或多筆更新
+    updated_columns = []
+
+    for row_num in target_rows:
+        row_cells = []
+        for column_name, new_value in request.values_to_set.items():
+            if column_name not in headers:
+                logger.warning(f"Column '{column_name}' not found in headers, skipping")
+                continue
+
+            row_cells.append((headers[column_name], new_value))
+            if column_name not in updated_columns:
+                updated_columns.append(column_name)
+            logger.info(f"Updated row {row_num}, column '{column_name}' = {new_value}")
+        write_cells(ws, row_num, row_cells)
+
+    cleanup_all_empty_rows(ws)
+    save_workbook(wb, file_path)
+
+    return {
+        "success": True, 
+        "message": f"{len(target_rows)} row(s) updated",
+        "rows_updated": target_rows,
+        "updated_count": len(target_rows),
+        "updated_columns": updated_columns,
+        "process_mode": "all" if request.process_all else "first"
+    }
+
 @app.put("/api/excel/update_advanced")
 async def update_row_advanced(request: UpdateAdvancedRequest, token: str = Depends(verify_token)):
     """
@@ -471,74 +2780,10 @@ async def update_row_advanced(request: UpdateAdvancedRequest, token: str = Depen
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        if not file_lock_manager.acquire(str(file_path)):
+        if not await file_lock_manager.acquire_async(str(file_path)):
             raise HTTPException(status_code=503, detail="File is locked")
         try:
-            wb, ws = get_worksheet(file_path, request.sheet)
-            
-            # 確定要更新的列號
-            target_rows = []
-            if request.row is not None:
-                # 方式1: 直接指定列號
-                target_row = request.row
-                if target_row < 1 or target_row > ws.max_row:
-                    raise HTTPException(status_code=400, detail=f"Invalid row number: {target_row}")
-                # 🔒 保護標題列
-                if target_row == 1:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail="Cannot update header row (row 1). Data rows start from row 2."
-                    )
-                target_rows = [target_row]
-            elif request.lookup_column and request.lookup_value:
-                # 方式2: 透過 Lookup 查找所有符合條件的記錄
-                matched_rows = find_all_rows_by_lookup(ws, request.lookup_column, request.lookup_value)
-                if not matched_rows:
-                    raise HTTPException(
-                        status_code=404, 
-                        detail=f"No row found where {request.lookup_column} = {request.lookup_value}"
-                    )
-                # 🆕 根據 process_all 決定處理哪些記錄
-                if request.process_all:
-                    target_rows = matched_rows  # 處理所有匹配記錄
-                else:
-                    target_rows = [matched_rows[0]]  # 只處理第一筆
-                    logger.info(f"Process mode: First match only (row {matched_rows[0]})")
-            else:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Must provide either 'row' or both 'lookup_column' and 'lookup_value'"
-                )
-            
-            # 獲取表頭
-            headers = get_headers(ws)
-            
-            # 處理單筆或多筆更新
-            updated_columns = []
-            
-            for row_num in target_rows:
-                for column_name, new_value in request.values_to_set.items():
-                    if column_name not in headers:
-                        logger.warning(f"Column '{column_name}' not found in headers, skipping")
-                        continue
-                    
-                    col_idx = headers[column_name]
-                    ws.cell(row=row_num, column=col_idx, value=new_value)
-                    if column_name not in updated_columns:
-                        updated_columns.append(column_name)
-                    logger.info(f"Updated row {row_num}, column '{column_name}' = {new_value}")
-            
-            cleanup_all_empty_rows(ws)
-            save_workbook(wb, file_path)
-            
-            return {
-                "success": True, 
-                "message": f"{len(target_rows)} row(s) updated",
-                "rows_updated": target_rows,
-                "updated_count": len(target_rows),
-                "updated_columns": updated_columns,
-                "process_mode": "all" if request.process_all else "first"
-            }
+            return await run_in_excel_executor(apply_update_advanced, file_path, request)
         finally:
             file_lock_manager.release(str(file_path))
     except HTTPException:
@@ -547,6 +2792,32 @@ async def update_row_advanced(request: UpdateAdvancedRequest, token: str = Depen
         logger.error(f"Error updating row: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def apply_delete_advanced(file_path: Path, request: DeleteAdvancedRequest) -> Dict[str, Any]:
+    """執行進階刪除並儲存(呼叫端需已持有檔案鎖定)"""
+    wb, ws = get_worksheet(file_path, request.sheet)
+
+    try:
+        target_rows = resolve_target_rows(ws, request, "delete")
+    except HTTPException:
+        # 尚未修改工作簿，歸還快取供下一個請求使用
+        workbook_cache.checkin(file_path, wb)
+        raise
+
+    # 處理單筆或多筆刪除(一次壓縮，避免逐列刪除時重複搬移後面的列)
+    delete_rows_bulk(ws, target_rows)
+    logger.info(f"Deleted {len(target_rows)} row(s): {sorted(target_rows)}")
+
+    cleanup_all_empty_rows(ws)
+    save_workbook(wb, file_path)
+
+    return {
+        "success": True, 
+        "message": f"{len(target_rows)} row(s) deleted",
+        "rows_deleted": target_rows,
+        "deleted_count": len(target_rows),
+        "process_mode": "all" if request.process_all else "first"
+    }
+
 @app.delete("/api/excel/delete_advanced")
 async def delete_row_advanced(request: DeleteAdvancedRequest, token: str = Depends(verify_token)):
     """
@@ -558,62 +2829,10 @@ async def delete_row_advanced(request: DeleteAdvancedRequest, token: str = Depen
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        if not file_lock_manager.acquire(str(file_path)):
+        if not await file_lock_manager.acquire_async(str(file_path)):
             raise HTTPException(status_code=503, detail="File is locked")
         try:
-            wb, ws = get_worksheet(file_path, request.sheet)
-            
-            # 確定要刪除的列號
-            target_rows = []
-            if request.row is not None:
-                # 方式1: 直接指定列號
-                target_row = request.row
-                if target_row < 1 or target_row > ws.max_row:
-                    raise HTTPException(status_code=400, detail=f"Invalid row number: {target_row}")
-                # 🔒 保護標題列
-                if target_row == 1:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail="Cannot delete header row (row 1). Data rows start from row 2."
-                    )
-                target_rows = [target_row]
-            elif request.lookup_column and request.lookup_value:
-                # 方式2: 透過 Lookup 查找所有符合條件的記錄
-                matched_rows = find_all_rows_by_lookup(ws, request.lookup_column, request.lookup_value)
-                if not matched_rows:
-                    raise HTTPException(
-                        status_code=404, 
-                        detail=f"No row found where {request.lookup_column} = {request.lookup_value}"
-                    )
-                # 🆕 根據 process_all 決定處理哪些記錄
-                if request.process_all:
-                    target_rows = matched_rows  # 處理所有匹配記錄
-                else:
-                    target_rows = [matched_rows[0]]  # 只處理第一筆
-                    logger.info(f"Process mode: First match only (row {matched_rows[0]})")
-            else:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Must provide either 'row' or both 'lookup_column' and 'lookup_value'"
-                )
-            
-            # 處理單筆或多筆刪除(從後往前刪除以避免行號偏移)
-            rows_to_delete = sorted(target_rows, reverse=True)
-            
-            for row_num in rows_to_delete:
-                ws.delete_rows(row_num)
-                logger.info(f"Deleted row {row_num}")
-            
-            cleanup_all_empty_rows(ws)
-            save_workbook(wb, file_path)
-            
-            return {
-                "success": True, 
-                "message": f"{len(target_rows)} row(s) deleted",
-                "rows_deleted": target_rows,
-                "deleted_count": len(target_rows),
-                "process_mode": "all" if request.process_all else "first"
-            }
+            return await run_in_excel_executor(apply_delete_advanced, file_path, request)
         finally:
             file_lock_manager.release(str(file_path))
     except HTTPException:
@@ -622,38 +2841,175 @@ async def delete_row_advanced(request: DeleteAdvancedRequest, token: str = Depen
         logger.error(f"Error deleting row: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 需要表頭的批次操作類型，整批只讀取一次表頭
+HEADER_BATCH_OPERATIONS = {"append_object", "update_by_lookup", "delete_by_lookup"}
+
+class BatchPlanner:
+    """
+    批次操作規劃器，讓整批操作在線性時間內完成且語意明確
+    - 所有列號都以批次開始前的編號解析，刪除延後到最後一次壓縮，不會改變後續操作的列號
+    - 同一列的多次更新合併為一次寫入；查找前先寫入待處理的變更，讓查找看到先前操作的結果
+    - 新增以游標依序指定列號，不需重新計算最後資料列
+    """
+    def __init__(self, ws, needs_headers: bool):
+        self.ws = ws
+        self.headers = get_headers(ws) if needs_headers else None
+        self.cursor = get_real_last_row(ws) + 1
+        self.pending: Dict[int, Dict[int, Any]] = {}
+        self.deleted: set = set()
+        self.appended: List[Tuple[Dict[str, Any], int]] = []
+    
+    def _stage(self, row: int, cells) -> None:
+        """
+        合併同一列的寫入；None 不會覆寫值，因此不取代先前合併的值
+        值在此先檢查，不合法時整個操作都不暫存，錯誤回報給這個操作而不是之後的 flush()
+        """
+        cells = check_cell_values(self.ws, cells)
+        merged = self.pending.setdefault(row, {})
+        for col_idx, value in cells:
+            if value is not None or col_idx not in merged:
+                merged[col_idx] = value
+    
+    def flush(self) -> None:
+        for row, cells in self.pending.items():
+            write_cells(self.ws, row, cells.items())
+        self.pending.clear()
+    
+    def _check_row(self, row: Optional[int], action: str, past_end: bool = False) -> int:
+        """past_end 允許指定最後資料列之後的列(更新)；刪除延後套用，不能指定之後可能由新增使用的列"""
+        if row is None or row < 1 or (row >= self.cursor and not past_end):
+            raise HTTPException(status_code=400, detail=f"Invalid row number: {row}")
+        if row in self.deleted:
+            raise HTTPException(status_code=400, detail=f"Cannot {action} row {row}: it is deleted earlier in this batch")
+        return row
+    
+    def _require_headers(self) -> Dict[str, int]:
+        if not self.headers:
+            raise HTTPException(
+                status_code=400, 
+                detail="No headers found in row 1. Please ensure the first row contains column names."
+            )
+        return self.headers
+    
+    def _lookup(self, op: BatchOperation) -> List[int]:
+        headers = self._require_headers()
+        if not op.lookup_column or not op.lookup_value:
+            raise HTTPException(status_code=400, detail=f"{op.type} requires 'lookup_column' and 'lookup_value'")
+        self.flush()
+        matched_rows = [
+            row for row in find_all_rows_by_lookup(self.ws, op.lookup_column, op.lookup_value, headers)
+            if row not in self.deleted
+        ]
+        if not matched_rows:
+            raise HTTPException(status_code=404, detail=f"No row found where {op.lookup_column} = {op.lookup_value}")
+        return matched_rows if op.process_all else matched_rows[:1]
+    
+    def _append(self, op_type: str, cells: List[Tuple[int, Any]]) -> Dict[str, Any]:
+        if not has_values(value for _, value in cells):
+            raise HTTPException(status_code=400, detail=f"{op_type} requires at least one value")
+        row = self.cursor
+        self._stage(row, cells)
+        self.cursor += 1
+        result = {"operation": op_type, "success": True, "row_number": row}
+        self.appended.append((result, row))
+        return result
+    
+    def apply(self, op: BatchOperation) -> Dict[str, Any]:
+        if op.type == "append":
+            if not isinstance(op.values, list):
+                raise HTTPException(status_code=400, detail="append requires 'values' as a list")
+            return self._append("append", list(enumerate(op.values, start=1)))
+        if op.type == "append_object":
+            if not isinstance(op.values, dict):
+                raise HTTPException(status_code=400, detail="append_object requires 'values' as an object")
+            self._require_headers()
+            template = get_column_template(self.ws, op.values)
+            result = self._append("append_object", template.row_cells(op.values))
+            result["matched_columns"] = list(template.matched)
+            result["ignored_columns"] = list(template.ignored)
+            return result
+        if op.type == "update":
+            if not isinstance(op.values, list) or not op.column_start or op.column_start < 1:
+                raise HTTPException(status_code=400, detail="update requires 'values' as a list and 'column_start' >= 1")
+            row = self._check_row(op.row, "update", past_end=True)
+            self._stage(row, enumerate(op.values, op.column_start))
+            if row >= self.cursor and has_values(op.values):
+                # 寫入最後資料列之後的列，之後的新增接在這一列後面
+                self.cursor = row + 1
+            if row == 1 and self.headers is not None:
+                # 表頭列被修改，重新讀取表頭
+                self.flush()
+                self.headers = get_headers(self.ws)
+            return {"operation": "update", "success": True, "row": row}
+        if op.type == "delete":
+            row = self._check_row(op.row, "delete")
+            if row == 1:
+                raise HTTPException(status_code=400, detail="Cannot delete header row (row 1). Data rows start from row 2.")
+            self.deleted.add(row)
+            return {"operation": "delete", "success": True, "row": row}
+        if op.type == "update_by_lookup":
+            if not op.values_to_set:
+                raise HTTPException(status_code=400, detail="update_by_lookup requires 'values_to_set'")
+            target_rows = self._lookup(op)
+            row_cells = [(self.headers[name], value) for name, value in op.values_to_set.items() if name in self.headers]
+            for row in target_rows:
+                self._stage(row, row_cells)
+            return {"operation": "update_by_lookup", "success": True, "rows": target_rows}
+        if op.type == "delete_by_lookup":
+            target_rows = self._lookup(op)
+            self.deleted.update(target_rows)
+            return {"operation": "delete_by_lookup", "success": True, "rows": target_rows}
+        raise HTTPException(status_code=400, detail=f"Unknown operation type '{op.type}'")
+    
+    def finish(self) -> None:
+        """
+        寫入合併後的變更並一次壓縮刪除的列；新增結果改為壓縮後的最終列號
+        新增的列在同一批次中被刪除時，row_number 為 None 並標示 deleted
+        """
+        self.flush()
+        if not self.deleted:
+            return
+        drop = sorted(self.deleted)
+        delete_rows_bulk(self.ws, drop)
+        logger.info(f"Batch deleted {len(drop)} row(s) in one compaction")
+        for result, row in self.appended:
+            if row in self.deleted:
+                result["row_number"] = None
+                result["deleted"] = True
+            else:
+                result["row_number"] = row - bisect.bisect_left(drop, row)
+
+def apply_batch_operations(file_path: Path, request: BatchRequest) -> Dict[str, Any]:
+    """
+    規劃並執行批次操作，儲存一次(呼叫端需已持有檔案鎖定)
+    操作中的列號一律指批次開始前的列號；新增的結果返回最終列號
+    """
+    ensure_file_exists(file_path, request.sheet)
+    wb, ws = get_worksheet(file_path, request.sheet)
+
+    cleanup_all_empty_rows(ws)
+    planner = BatchPlanner(ws, any(op.type in HEADER_BATCH_OPERATIONS for op in request.operations))
+
+    results = []
+    for op in request.operations:
+        try:
+            results.append(planner.apply(op))
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            results.append({"operation": op.type, "success": False, "error": error})
+    planner.finish()
+
+    save_workbook(wb, file_path)
+    return {"success": True, "results": results}
+
 @app.post("/api/excel/batch")
 async def batch_operations(request: BatchRequest, token: str = Depends(verify_token)):
     file_path = validate_file_path(request.file)
     try:
-        if not file_lock_manager.acquire(str(file_path), timeout=60.0):
+        if not await file_lock_manager.acquire_async(str(file_path), timeout=60.0):
             raise HTTPException(status_code=503, detail="File is locked")
         try:
-            ensure_file_exists(file_path, request.sheet)
-            wb, ws = get_worksheet(file_path, request.sheet)
-            
-            cleanup_all_empty_rows(ws)
-            
-            results = []
-            for op in request.operations:
-                try:
-                    if op.type == "append":
-                        nr = get_real_last_row(ws) + 1
-                        for ci, v in enumerate(op.values, 1):
-                            ws.cell(row=nr, column=ci, value=v)
-                        results.append({"operation": "append", "success": True, "row_number": nr})
-                    elif op.type == "update":
-                        for ci, v in enumerate(op.values, op.column_start):
-                            ws.cell(row=op.row, column=ci, value=v)
-                        results.append({"operation": "update", "success": True, "row": op.row})
-                    elif op.type == "delete":
-                        ws.delete_rows(op.row)
-                        results.append({"operation": "delete", "success": True, "row": op.row})
-                except Exception as e:
-                    results.append({"operation": op.type, "success": False, "error": str(e)})
-            
-            save_workbook(wb, file_path)
-            return {"success": True, "results": results}
+            return await run_in_excel_executor(apply_batch_operations, file_path, request)
         finally:
             file_lock_manager.release(str(file_path))
     except Exception as e:
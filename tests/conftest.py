@@ -12,7 +12,7 @@ import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import main
-from main import app, file_lock_manager
+from main import app, file_lock_manager, workbook_cache
 
 # 測試用的 API Token
 TEST_TOKEN = "test-token-12345"
@@ -58,6 +58,9 @@ def clean_test_env(test_data_dir, monkeypatch):
     file_lock_manager.locks.clear()
     file_lock_manager.lock_times.clear()
     
+    # 清理工作簿快取
+    workbook_cache.clear()
+    
     yield test_data_dir
 
 @pytest.fixture(scope="function")
@@ -118,3 +118,139 @@ def test_batch_large_operations(client, auth_headers):
     # 驗證所有操作都成功
     for result in data["results"]:
         assert result["success"] is True
+
+def test_batch_lookup_operations(client, auth_headers, sample_excel_file, caplog):
+    """測試批次中的 append_object、update_by_lookup、delete_by_lookup 共用表頭與查找索引"""
+    import logging
+    caplog.set_level(logging.INFO, logger="main")
+    response = client.post(
+        "/api/excel/batch",
+        headers=auth_headers,
+        json={
+            "file": "test.xlsx",
+            "sheet": "Sheet1",
+            "operations": [
+                {"type": "append_object", "values": {"ID": "E004", "Name": "Keyed", "Department": "Sales"}},
+                {"type": "update_by_lookup", "lookup_column": "Department", "lookup_value": "Sales",
+                 "values_to_set": {"Salary": 70000}},
+                {"type": "delete_by_lookup", "lookup_column": "ID", "lookup_value": "E001"},
+                {"type": "update_by_lookup", "lookup_column": "ID", "lookup_value": "E999",
+                 "values_to_set": {"Salary": 1}},
+                {"type": "rename"}
+            ]
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()["results"]
+    # 新增的結果為刪除壓縮後的最終列號
+    assert results[0]["success"] is True and results[0]["row_number"] == 4
+    assert results[1]["rows"] == [3, 5]
+    assert results[2]["rows"] == [2]
+    assert results[3]["success"] is False and "No row found" in results[3]["error"]
+    assert results[4]["success"] is False and "Unknown operation type" in results[4]["error"]
+    assert sum("Built lookup index for column 3" in r.message for r in caplog.records) == 1
+    
+    read = client.post(
+        "/api/excel/read",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1"}
+    ).json()
+    assert read["data"][1:] == [
+        ["E002", "Jane Smith", "Sales", 70000],
+        ["E003", "Bob Johnson", "HR", 60000],
+        ["E004", "Keyed", "Sales", 70000],
+    ]
+
+def test_batch_planner_uses_original_row_numbers(client, auth_headers, sample_excel_file):
+    """測試批次中的列號以批次開始前為準：刪除延後壓縮、同列更新合併、新增返回最終列號"""
+    response = client.post(
+        "/api/excel/batch",
+        headers=auth_headers,
+        json={
+            "file": "test.xlsx",
+            "sheet": "Sheet1",
+            "operations": [
+                {"type": "delete", "row": 2},
+                {"type": "update", "row": 3, "values": ["Updated"], "column_start": 2},
+                {"type": "append", "values": ["E004", "Appended", "IT", 1]},
+                {"type": "update", "row": 3, "values": [99], "column_start": 4},
+                {"type": "update", "row": 2, "values": ["Gone"], "column_start": 2},
+                {"type": "delete", "row": 5},
+                {"type": "append", "values": ["E005", "Last", "IT", 2]},
+                {"type": "delete", "row": 1}
+            ]
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()["results"]
+    assert [r["success"] for r in results] == [True, True, True, True, False, True, True, False]
+    assert "deleted earlier in this batch" in results[4]["error"]
+    # 第 5 列是同一批次新增的列，刪除後不再返回列號
+    assert results[2]["row_number"] is None and results[2]["deleted"] is True
+    assert results[6]["row_number"] == 4
+    
+    read = client.post(
+        "/api/excel/read",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1"}
+    ).json()
+    assert read["data"] == [
+        ["ID", "Name", "Department", "Salary"],
+        ["E002", "Updated", "Sales", 99],
+        ["E003", "Bob Johnson", "HR", 60000],
+        ["E005", "Last", "IT", 2],
+    ]
+
+def test_batch_update_past_last_row(client, auth_headers, sample_excel_file):
+    """測試批次可更新最後資料列之後的列，之後的新增接在該列後面；刪除不能指定最後資料列之後的列"""
+    response = client.post(
+        "/api/excel/batch",
+        headers=auth_headers,
+        json={
+            "file": "test.xlsx",
+            "sheet": "Sheet1",
+            "operations": [
+                {"type": "update", "row": 6, "values": ["E006", "Far"], "column_start": 1},
+                {"type": "append", "values": ["E007", "Next"]},
+                {"type": "delete", "row": 9}
+            ]
+        }
+    )
+    results = response.json()["results"]
+    assert [r["success"] for r in results] == [True, True, False]
+    assert results[1]["row_number"] == 7
+    
+    read = client.post(
+        "/api/excel/read",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1", "range": "A5:B7"}
+    ).json()
+    assert read["data"] == [["E006", "Far"], ["E007", "Next"]]
+
+def test_batch_invalid_value_fails_only_its_operation(client, auth_headers, sample_excel_file):
+    """測試 openpyxl 不接受的值只讓該操作失敗，之前與之後的操作(含查找)仍會套用"""
+    response = client.post(
+        "/api/excel/batch",
+        headers=auth_headers,
+        json={
+            "file": "test.xlsx",
+            "sheet": "Sheet1",
+            "operations": [
+                {"type": "update", "row": 2, "values": [{"x": 1}], "column_start": 1},
+                {"type": "append", "values": ["E004", "bad\x01"]},
+                {"type": "update_by_lookup", "lookup_column": "ID", "lookup_value": "E002", "values_to_set": {"Name": "Looked up"}},
+                {"type": "append", "values": ["E005", "Valid"]}
+            ]
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()["results"]
+    assert [r["success"] for r in results] == [False, False, True, True]
+    assert "Cannot convert" in results[0]["error"]
+    
+    read = client.post(
+        "/api/excel/read",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1", "range": "A2:B5"}
+    ).json()
+    assert read["data"] == [["E001", "John Doe"], ["E002", "Looked up"], ["E003", "Bob Johnson"], ["E005", "Valid"]]
@@ -61,6 +61,150 @@ class TestAppendOperations:
         assert len(data["matched_columns"]) == 4
         assert len(data["ignored_columns"]) == 0
 
+    def test_append_many(self, client, auth_headers, sample_excel_file, monkeypatch):
+        """測試一次新增多列，只儲存一次並返回列號範圍"""
+        import main
+        save_count = []
+        original_save = main.save_workbook
+        monkeypatch.setattr(main, "save_workbook", lambda wb, path: (save_count.append(path), original_save(wb, path)))
+        
+        rows = [[f"B{i:03d}", f"Bulk {i}", "Ops", 1000 + i] for i in range(50)]
+        response = client.post(
+            "/api/excel/append_many",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "rows": rows}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert (data["first_row"], data["last_row"], data["row_count"]) == (5, 54, 50)
+        assert len(save_count) == 1
+        
+        read = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "offset": 4}
+        ).json()
+        assert read["data"] == rows
+        
+        response = client.post(
+            "/api/excel/append_many",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "rows": [["X"], [None, ""]]}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "[1]" in response.json()["detail"]
+    
+    def test_append_objects(self, client, auth_headers, sample_excel_file):
+        """測試物件模式一次新增多列，並回報每列被忽略的欄位"""
+        response = client.post(
+            "/api/excel/append_objects",
+            headers=auth_headers,
+            json={
+                "file": "test.xlsx",
+                "sheet": "Sheet1",
+                "rows": [
+                    {"ID": "E005", "Name": "First"},
+                    {"ID": "E006", "Salary": 90000, "Nickname": "Six"},
+                ]
+            }
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert (data["first_row"], data["last_row"]) == (5, 6)
+        assert data["ignored"] == [{"index": 1, "row_number": 6, "ignored_columns": ["Nickname"]}]
+        
+        read = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "range": "A5:D6"}
+        ).json()
+        assert read["data"] == [["E005", "First", None, None], ["E006", None, None, 90000]]
+
+    def test_upsert_by_key_column(self, client, auth_headers, sample_excel_file, monkeypatch):
+        """測試依主鍵批次更新或新增，只儲存一次並回報各類筆數"""
+        import main
+        save_count = []
+        original_save = main.save_workbook
+        monkeypatch.setattr(main, "save_workbook", lambda wb, path: (save_count.append(path), original_save(wb, path)))
+        
+        response = client.post(
+            "/api/excel/upsert",
+            headers=auth_headers,
+            json={
+                "file": "test.xlsx",
+                "sheet": "Sheet1",
+                "key_column": "ID",
+                "records": [
+                    {"ID": "E001", "Salary": 80000},
+                    {"ID": "E002", "Department": "Sales"},
+                    {"ID": "E004", "Name": "New Hire", "Badge": 7},
+                    {"ID": "E004", "Department": "IT"},
+                ]
+            }
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert (data["inserted"], data["updated"], data["unchanged"]) == (1, 2, 1)
+        assert data["ignored"] == [{"index": 2, "ignored_columns": ["Badge"]}]
+        assert len(save_count) == 1
+        
+        read = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1"}
+        ).json()
+        assert read["data"][1] == ["E001", "John Doe", "Engineering", 80000]
+        assert read["data"][4] == ["E004", "New Hire", "IT", None]
+        
+        response = client.post(
+            "/api/excel/upsert",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "key_column": "ID", "records": [{"Name": "No Key"}]}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_append_patches_sheet_xml(self, client, auth_headers, sample_excel_file, monkeypatch):
+        """測試只新增列時直接修補工作表 XML，內容與 openpyxl 完整儲存一致"""
+        import main
+        import openpyxl
+        import zipfile
+        expected = openpyxl.load_workbook(sample_excel_file)
+        with zipfile.ZipFile(sample_excel_file) as zf:
+            styles = zf.read("xl/styles.xml")
+        full_saves = []
+        original_save = main.atomic_save
+        monkeypatch.setattr(main, "atomic_save", lambda wb, path: (full_saves.append(path), original_save(wb, path)))
+        
+        rows = [["E100", " padded ", True, 1.5], ["E101", None, "=D5*2", 0.1 + 0.2], ["E102", "#N/A", "", 10 ** 12]]
+        response = client.post(
+            "/api/excel/append_many",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "rows": rows}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert full_saves == []
+        
+        for row in rows:
+            expected["Sheet1"].append(row)
+        expected_path = sample_excel_file.parent / "expected.xlsx"
+        expected.save(expected_path)
+        patched = openpyxl.load_workbook(sample_excel_file)["Sheet1"]
+        saved = openpyxl.load_workbook(expected_path)["Sheet1"]
+        assert [[c.value for c in row] for row in patched.iter_rows()] == [[c.value for c in row] for row in saved.iter_rows()]
+        assert openpyxl.load_workbook(sample_excel_file, read_only=True)["Sheet1"].max_row == 7
+        with zipfile.ZipFile(sample_excel_file) as zf:
+            assert zf.read("xl/styles.xml") == styles
+        
+        # 修改既有的列無法直接修補，改用完整儲存
+        response = client.put(
+            "/api/excel/update_advanced",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "row": 2, "values_to_set": {"Name": "Renamed"}}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert full_saves == [sample_excel_file]
+        assert openpyxl.load_workbook(sample_excel_file)["Sheet1"]["B2"].value == "Renamed"
+
 class TestReadOperations:
     """讀取操作測試"""
     
@@ -123,6 +267,321 @@ class TestReadOperations:
         data = response.json()
         assert "Sheet 'NonExistentSheet' not found" in data["detail"]
 
+    def test_read_sheet_not_starting_at_a1(self, client, auth_headers, clean_test_env):
+        """測試資料不從 A1 開始時，讀取仍從 A 欄開始(欄位位置不偏移)，與串流讀取一致"""
+        import json
+        import openpyxl
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Sheet1"
+        ws["B2"], ws["C2"] = "ID", "Name"
+        ws["B3"], ws["C3"] = "E1", "a"
+        wb.save(clean_test_env / "offset.xlsx")
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "offset.xlsx", "sheet": "Sheet1"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        expected = [[None, "ID", "Name"], [None, "E1", "a"]]
+        assert response.json()["data"] == expected
+        
+        stream = client.post(
+            "/api/excel/read_stream",
+            headers=auth_headers,
+            json={"file": "offset.xlsx", "sheet": "Sheet1"}
+        )
+        assert [json.loads(line) for line in stream.text.splitlines()] == expected
+    
+    def test_read_stream_ndjson(self, client, auth_headers, sample_excel_file):
+        """測試以 NDJSON 串流讀取，內容與一般讀取相同"""
+        import json
+        expected = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1"}
+        ).json()["data"]
+        
+        response = client.post(
+            "/api/excel/read_stream",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert [json.loads(line) for line in response.text.splitlines()] == expected
+        
+        # 串流結束後應釋放共用鎖定
+        from main import file_lock_manager
+        assert str(sample_excel_file) not in file_lock_manager.locks
+    
+    def test_read_stream_json_array(self, client, auth_headers, sample_excel_file):
+        """測試以分段 JSON 陣列串流讀取指定範圍"""
+        response = client.post(
+            "/api/excel/read_stream",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "range": "A1:B3", "stream_format": "json"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == [["ID", "Name"], ["E001", "John Doe"], ["E002", "Jane Smith"]]
+    
+    def test_read_stream_nonexistent_sheet(self, client, auth_headers, sample_excel_file):
+        """測試串流讀取不存在的工作表"""
+        response = client.post(
+            "/api/excel/read_stream",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "NonExistentSheet"}
+        )
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert "Sheet 'NonExistentSheet' not found" in response.json()["detail"]
+    
+    def test_read_stream_invalid_range(self, client, auth_headers, sample_excel_file):
+        """測試串流讀取無效範圍時在開始串流前返回 400，與 /read 相同"""
+        for endpoint in ("/api/excel/read_stream", "/api/excel/read"):
+            response = client.post(
+                endpoint,
+                headers=auth_headers,
+                json={"file": "test.xlsx", "sheet": "Sheet1", "range": "bogus"}
+            )
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+            assert "Invalid range 'bogus'" in response.json()["detail"]
+
+    def test_read_offset_limit_and_cursor(self, client, auth_headers, sample_excel_file):
+        """測試 offset/limit 分頁與游標續讀，結果與完整讀取一致"""
+        full = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1"}
+        ).json()["data"]
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "offset": 1, "limit": 1}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        page = response.json()
+        assert page["data"] == full[1:2]
+        assert page["has_more"] is True
+        
+        pages = page["data"]
+        cursor = page["next_cursor"]
+        while cursor:
+            page = client.post(
+                "/api/excel/read",
+                headers=auth_headers,
+                json={"file": "test.xlsx", "sheet": "Sheet1", "limit": 1, "cursor": cursor}
+            ).json()
+            pages.extend(page["data"])
+            cursor = page["next_cursor"]
+        assert pages == full[1:]
+        assert page["has_more"] is False
+    
+    def test_read_cursor_rejected_after_file_change(self, client, auth_headers, sample_excel_file):
+        """測試檔案變更後舊游標返回 409，格式錯誤的游標返回 400"""
+        page = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "limit": 1}
+        ).json()
+        
+        client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "values": ["E999", "New", "IT", 1]}
+        )
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "limit": 1, "cursor": page["next_cursor"]}
+        )
+        assert response.status_code == status.HTTP_409_CONFLICT
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "cursor": "not-a-cursor"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_read_where_filters_rows(self, client, auth_headers, sample_excel_file):
+        """測試 where 條件：相等、列表、數值比較、前綴與 AND/OR 組合"""
+        def read_where(where):
+            response = client.post(
+                "/api/excel/read",
+                headers=auth_headers,
+                json={"file": "test.xlsx", "sheet": "Sheet1", "where": where}
+            )
+            assert response.status_code == status.HTTP_200_OK
+            data = response.json()["data"]
+            assert data[0] == ["ID", "Name", "Department", "Salary"]
+            return [row[0] for row in data[1:]]
+        
+        assert read_where({"column": "Department", "op": "eq", "value": "Sales"}) == ["E002"]
+        assert read_where({"column": "ID", "op": "in", "value": ["E003", "E001"]}) == ["E001", "E003"]
+        assert read_where({"column": "Salary", "op": "gte", "value": 65000}) == ["E001", "E002"]
+        assert read_where({"column": "Name", "op": "prefix", "value": "J"}) == ["E001", "E002"]
+        assert read_where({"column": "Department", "op": "is_null"}) == []
+        assert read_where({"and": [
+            {"column": "Salary", "op": "lt", "value": 70000},
+            {"or": [
+                {"column": "Department", "op": "eq", "value": "HR"},
+                {"column": "Name", "op": "prefix", "value": "Jane"}
+            ]}
+        ]}) == ["E002", "E003"]
+    
+    def test_read_where_uses_lookup_index(self, client, auth_headers, sample_excel_file, caplog):
+        """測試 eq 條件由查找索引提供候選列，索引只建立一次"""
+        import logging
+        caplog.set_level(logging.INFO, logger="main")
+        for _ in range(2):
+            response = client.post(
+                "/api/excel/read",
+                headers=auth_headers,
+                json={"file": "test.xlsx", "sheet": "Sheet1", "where": {"column": "ID", "value": "E003"}}
+            )
+            assert response.json()["data"][1] == ["E003", "Bob Johnson", "HR", 60000]
+        assert sum("Built lookup index" in r.message for r in caplog.records) == 1
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "where": {"column": "Missing", "value": 1}}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "Where column 'Missing' not found" in response.json()["detail"]
+    
+    def test_read_where_date_comparison(self, client, auth_headers, clean_test_env):
+        """測試日期欄位以 ISO 字串比較"""
+        import openpyxl
+        from datetime import datetime
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Sheet1"
+        ws.append(["ID", "Joined"])
+        ws.append(["E001", datetime(2023, 5, 1)])
+        ws.append(["E002", datetime(2024, 2, 1)])
+        for row in ws.iter_rows(min_row=2, min_col=2):
+            row[0].number_format = "yyyy-mm-dd"
+        wb.save(clean_test_env / "dates.xlsx")
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "dates.xlsx", "sheet": "Sheet1", "where": {"column": "Joined", "op": "gt", "value": "2024-01-01"}}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["data"] == [["ID", "Joined"], ["E002", "2024-02-01"]]
+        
+        # 帶時差的 ISO 字串換算為 UTC 後比較(2024-01-31T20:00-05:00 為 2024-02-01T01:00 UTC)
+        for op, operand, expected in [
+            ("gte", "2024-02-01T00:00:00+00:00", [["ID", "Joined"], ["E002", "2024-02-01"]]),
+            ("gt", "2024-01-31T20:00:00-05:00", [["ID", "Joined"]]),
+        ]:
+            response = client.post(
+                "/api/excel/read",
+                headers=auth_headers,
+                json={"file": "dates.xlsx", "sheet": "Sheet1", "where": {"column": "Joined", "op": op, "value": operand}}
+            )
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["data"] == expected
+
+    def test_read_columns_projection(self, client, auth_headers, sample_excel_file):
+        """測試依表頭名稱投影欄位，並依指定順序返回"""
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={
+                "file": "test.xlsx",
+                "sheet": "Sheet1",
+                "columns": ["Salary", "ID"],
+                "where": {"column": "Department", "value": "HR"}
+            }
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["data"] == [["Salary", "ID"], [60000, "E003"]]
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "columns": ["ID", "Unknown"]}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "['Unknown'] not found" in response.json()["detail"]
+        
+        # 範圍限制欄時，範圍外的欄位返回 400；只限制列的範圍不影響欄位投影
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "range": "A1:B2", "columns": ["Salary"]}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "['Salary'] are outside the requested range (A:B)" in response.json()["detail"]
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "range": "1:2", "columns": ["Salary", "ID"]}
+        )
+        assert response.json()["data"] == [["Salary", "ID"], [75000, "E001"]]
+
+    def test_read_records_and_columnar_formats(self, client, auth_headers, sample_excel_file):
+        """測試 records 與 columnar 格式，重複的字串以字典編碼"""
+        client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "values": ["E004", "Amy Chen", "Sales", 50000]}
+        )
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "columns": ["ID", "Department"], "format": "records", "limit": 2}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        result = response.json()
+        assert result["data"] == [
+            {"ID": "E001", "Department": "Engineering"},
+            {"ID": "E002", "Department": "Sales"},
+        ]
+        assert result["has_more"] is True
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "columns": ["ID", "Department", "Salary"], "format": "columnar"}
+        )
+        result = response.json()
+        assert result["columns"] == ["ID", "Department", "Salary"]
+        assert result["row_count"] == 4
+        ids, departments, salaries = result["data"]
+        assert ids == ["E001", "E002", "E003", "E004"]
+        assert departments == {"dictionary": ["Engineering", "Sales", "HR"], "indices": [0, 1, 2, 1]}
+        assert salaries == [75000, 65000, 60000, 50000]
+    
+    def test_read_msgpack_format(self, client, auth_headers, sample_excel_file):
+        """測試 MessagePack 二進位格式"""
+        msgpack = pytest.importorskip("msgpack")
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "format": "msgpack"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"] == "application/x-msgpack"
+        result = msgpack.unpackb(response.content)
+        assert result["columns"] == ["ID", "Name", "Department", "Salary"]
+        assert result["rows"][0] == ["E001", "John Doe", "Engineering", 75000]
+        assert result["row_count"] == 3
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "format": "xml"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 class TestUpdateOperations:
     """更新操作測試"""
     
@@ -233,6 +692,44 @@ class TestUpdateOperations:
         assert len(data["rows_updated"]) == 1
         assert data["process_mode"] == "first"
     
+    def test_lookup_index_follows_updates_appends_and_deletes(self, client, auth_headers, sample_excel_file, caplog):
+        """測試查找索引只建立一次，並隨更新、新增、刪除保持正確"""
+        def update(lookup_value, values):
+            return client.put(
+                "/api/excel/update_advanced",
+                headers=auth_headers,
+                json={
+                    "file": "test.xlsx",
+                    "sheet": "Sheet1",
+                    "lookup_column": "ID",
+                    "lookup_value": lookup_value,
+                    "values_to_set": values
+                }
+            )
+        
+        caplog.set_level("INFO", logger="main")
+        assert update("E002", {"ID": "E902"}).json()["rows_updated"] == [3]
+        assert update("E902", {"Salary": 1}).json()["rows_updated"] == [3]
+        assert update("E002", {"Salary": 1}).status_code == status.HTTP_404_NOT_FOUND
+        
+        client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "values": ["E004", "New", "IT", 1]}
+        )
+        assert update("E004", {"Salary": 2}).json()["rows_updated"] == [5]
+        
+        client.request(
+            "DELETE",
+            "/api/excel/delete_advanced",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "lookup_column": "ID", "lookup_value": "E001"}
+        )
+        assert update("E004", {"Salary": 3}).json()["rows_updated"] == [4]
+        
+        builds = [r for r in caplog.records if r.getMessage().startswith("Built lookup index")]
+        assert len(builds) == 1
+    
     def test_update_invalid_row(self, client, auth_headers, sample_excel_file):
         """測試更新無效列號"""
         response = client.put(
@@ -307,6 +804,38 @@ class TestDeleteOperations:
         assert data["deleted_count"] == 1
         assert 4 in data["rows_deleted"]
     
+    def test_delete_advanced_many_matches_keeps_order(self, client, auth_headers, sample_excel_file):
+        """測試一次刪除大量符合記錄後，其餘資料順序不變"""
+        import openpyxl
+        wb = openpyxl.load_workbook(sample_excel_file)
+        ws = wb["Sheet1"]
+        for i in range(40):
+            ws.append([f"B{i:03d}", f"Bulk {i}", "Purge" if i % 2 == 0 else "Keep", i])
+        wb.save(sample_excel_file)
+        
+        response = client.request(
+            "DELETE",
+            "/api/excel/delete_advanced",
+            headers=auth_headers,
+            json={
+                "file": "test.xlsx",
+                "sheet": "Sheet1",
+                "lookup_column": "Department",
+                "lookup_value": "Purge"
+            }
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["deleted_count"] == 20
+        
+        response = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1"}
+        )
+        rows = response.json()["data"]
+        assert len(rows) == 1 + 3 + 20
+        assert [row[0] for row in rows[4:]] == [f"B{i:03d}" for i in range(1, 40, 2)]
+    
     def test_delete_advanced_multiple_matches(self, client, auth_headers, sample_excel_file):
         """測試進階刪除（多筆符合條件 - process_all=True）"""
         # 先新增兩筆相同 Department 的記錄
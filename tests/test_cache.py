@@ -0,0 +1,256 @@
+"""
+工作簿快取測試
+"""
+import pytest
+import openpyxl
+from fastapi import status
+
+import main
+from main import workbook_cache, WorkbookCache
+
+def read_all(client, auth_headers, file_name="test.xlsx"):
+    response = client.post(
+        "/api/excel/read",
+        headers=auth_headers,
+        json={"file": file_name, "sheet": "Sheet1"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+def test_repeated_reads_hit_cache(client, auth_headers, sample_excel_file):
+    """測試重複讀取不會重新解析檔案"""
+    read_all(client, auth_headers)
+    misses = workbook_cache.misses
+    hits = workbook_cache.hits
+    read_all(client, auth_headers)
+    assert workbook_cache.misses == misses
+    assert workbook_cache.hits == hits + 1
+
+def test_external_change_invalidates_cache(client, auth_headers, sample_excel_file):
+    """測試檔案被外部修改後快取失效"""
+    assert read_all(client, auth_headers)["row_count"] == 4
+    
+    wb = openpyxl.load_workbook(sample_excel_file)
+    wb["Sheet1"].append(["E099", "External", "Ops", 1])
+    wb.save(sample_excel_file)
+    
+    assert read_all(client, auth_headers)["row_count"] == 5
+
+def test_save_updates_cached_entry(client, auth_headers, sample_excel_file):
+    """測試寫入後快取項目直接更新，下次寫入不需重新載入"""
+    for i in range(2):
+        response = client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "values": [f"E1{i}", "Cached", "IT", 1]}
+        )
+        assert response.status_code == status.HTTP_200_OK
+    misses = workbook_cache.misses
+    response = client.post(
+        "/api/excel/append",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1", "values": ["E12", "Cached", "IT", 1]}
+    )
+    assert response.json()["row_number"] == 7
+    assert workbook_cache.misses == misses
+    assert read_all(client, auth_headers)["row_count"] == 7
+
+def test_save_publishes_snapshot_for_readers(client, auth_headers, sample_excel_file, monkeypatch):
+    """測試儲存後發布唯讀快照，讀取、表頭與工作表清單都不需重新解析檔案"""
+    # 先讀取一次，讓新增可套用到前一版快照上
+    read_all(client, auth_headers)
+    client.post(
+        "/api/excel/append",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1", "values": ["E004", "Snapshot", "IT", 1]}
+    )
+    loads = []
+    original_load = openpyxl.load_workbook
+    monkeypatch.setattr(main.openpyxl, "load_workbook", lambda *a, **kw: (loads.append(a), original_load(*a, **kw))[1])
+    
+    assert read_all(client, auth_headers)["data"][-1] == ["E004", "Snapshot", "IT", 1]
+    assert client.get("/api/excel/headers", headers=auth_headers, params={"file": "test.xlsx"}).json()["count"] == 4
+    assert client.get("/api/excel/sheets", headers=auth_headers, params={"file": "test.xlsx"}).json()["sheets"] == ["Sheet1"]
+    assert loads == []
+
+def test_snapshot_matches_data_only_reload(tmp_path):
+    """測試快照內容與以 data_only 重新載入儲存後的檔案一致"""
+    from datetime import date, datetime
+    file_path = tmp_path / "snapshot.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["ID", "Value", "Formula", "Date"])
+    ws.append([1, 2.5, "=A2+B2", date(2024, 1, 2)])
+    ws.append([True, datetime(2024, 3, 4, 5, 6, 7), "#N/A", None, ""])
+    ws["F7"].font = openpyxl.styles.Font(bold=True)
+    ws.merge_cells("A5:B6")
+    ws["A5"] = "merged"
+    wb.save(file_path)
+    
+    snapshot = main.WorkbookSnapshot.from_workbook(wb)["Sheet"]
+    reloaded = openpyxl.load_workbook(file_path, data_only=True)["Sheet"]
+    assert (snapshot.min_row, snapshot.max_row, snapshot.min_column, snapshot.max_column) == \
+        (reloaded.min_row, reloaded.max_row, reloaded.min_column, reloaded.max_column)
+    assert sorted(snapshot._cells) == sorted(reloaded._cells)
+    for key, cell in reloaded._cells.items():
+        assert main.format_cell_value(snapshot._cells[key]) == main.format_cell_value(cell)
+    
+    # 變更紀錄套用到快照後，也與重新載入的結果一致
+    applied = snapshot.apply([{"s": "Sheet", "r": 3, "c": [[6, ""], [7, "x"]]}])
+    ws.cell(row=3, column=6, value="")
+    ws.cell(row=3, column=7, value="x")
+    wb.save(file_path)
+    reloaded = openpyxl.load_workbook(file_path, data_only=True)["Sheet"]
+    assert sorted(applied._cells) == sorted(reloaded._cells)
+    for key, cell in reloaded._cells.items():
+        assert main.format_cell_value(applied._cells[key]) == main.format_cell_value(cell)
+
+def test_read_engines_match(client, auth_headers, clean_test_env):
+    """測試 xml 讀取引擎與 openpyxl 引擎的解析結果相同"""
+    from datetime import date, datetime, time, timedelta
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904
+    for epoch in (None, CALENDAR_MAC_1904):
+        file_path = clean_test_env / "engines.xlsx"
+        wb = openpyxl.Workbook()
+        if epoch is not None:
+            wb.epoch = epoch
+        ws = wb.active
+        ws.title = "Sheet1"
+        ws.append(["ID", "Name", "When", "Flag", "Ratio"])
+        ws.append([1, " padded ", date(2024, 1, 2), True, 0.1 + 0.2])
+        ws.append([2, "#N/A", datetime(2024, 3, 4, 5, 6, 7), False, "=A2+A3"])
+        ws.append([3, "", time(12, 30), None, 10 ** 15])
+        ws.append([4, "x", timedelta(hours=30), None, -1.5e-7])
+        ws["C2"].number_format = "yyyy-mm-dd"
+        ws["C5"].number_format = "[h]:mm:ss"
+        ws["F9"].font = openpyxl.styles.Font(bold=True)
+        ws.merge_cells("A7:B8")
+        ws["A7"] = "merged"
+        wb.create_sheet("Other")["B3"] = "only"
+        wb.save(file_path)
+        
+        expected = main.load_values_openpyxl(file_path)
+        snapshot = main.load_snapshot_xml(file_path)
+        assert isinstance(snapshot, main.WorkbookSnapshot)
+        assert snapshot.sheetnames == expected.sheetnames
+        for sheet in expected.worksheets:
+            parsed = snapshot[sheet.title]
+            assert (parsed.min_row, parsed.max_row, parsed.min_column, parsed.max_column) == \
+                (sheet.min_row, sheet.max_row, sheet.min_column, sheet.max_column)
+            assert sorted(parsed._cells) == sorted(sheet._cells)
+            for key, cell in sheet._cells.items():
+                assert main.format_cell_value(parsed._cells[key]) == main.format_cell_value(cell)
+        
+        results = []
+        for engine in ("openpyxl", "xml"):
+            workbook_cache.clear()
+            response = client.post(
+                "/api/excel/read",
+                headers=auth_headers,
+                json={"file": "engines.xlsx", "sheet": "Sheet1", "engine": engine}
+            )
+            assert response.status_code == status.HTTP_200_OK
+            results.append(response.json())
+        assert results[0] == results[1]
+    
+    response = client.post(
+        "/api/excel/read",
+        headers=auth_headers,
+        json={"file": "engines.xlsx", "sheet": "Sheet1", "engine": "pandas"}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_lru_eviction_respects_budget(sample_excel_file, tmp_path):
+    """測試超出記憶體預算時依 LRU 淘汰"""
+    other = tmp_path / "other.xlsx"
+    openpyxl.Workbook().save(other)
+    
+    cache = WorkbookCache(max_bytes=WorkbookCache.estimate_size(openpyxl.load_workbook(sample_excel_file)))
+    cache.get(sample_excel_file)
+    cache.get(other)
+    assert cache.current_bytes <= cache.max_bytes
+    
+    misses = cache.misses
+    cache.get(sample_excel_file)
+    assert cache.misses == misses + 1
+
+def test_append_uses_tracked_last_row(client, auth_headers, sample_excel_file, monkeypatch):
+    """測試連續新增只在第一次掃描工作表，之後使用維護的最後資料列標記"""
+    scans = []
+    
+    def counting(func):
+        def wrapper(ws):
+            scans.append(func.__name__)
+            return func(ws)
+        return wrapper
+    
+    monkeypatch.setattr(main, "scan_last_row", counting(main.scan_last_row))
+    monkeypatch.setattr(main, "find_empty_rows", counting(main.find_empty_rows))
+    
+    for i in range(5):
+        response = client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "values": [f"E2{i}", "Tracked"]}
+        )
+        assert response.json()["row_number"] == 5 + i
+    assert len(scans) <= 1
+
+def test_header_map_and_column_templates_are_cached():
+    """測試表頭與物件欄位對應只解析一次，修改或刪除第一列後重新解析"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    main.write_cells(ws, 1, [(1, "ID"), (2, "Name")])
+    headers = main.get_headers(ws)
+    assert main.get_headers(ws) is headers
+    
+    first = main.append_object_values(ws, {"ID": 1, "Name": "A", "Extra": "x"})
+    template = main.get_sheet_state(ws).templates[("ID", "Name", "Extra")]
+    second = main.append_object_values(ws, {"ID": 2, "Name": "B", "Extra": "y"})
+    assert main.get_sheet_state(ws).templates[("ID", "Name", "Extra")] is template
+    assert (first["row_number"], second["row_number"]) == (2, 3)
+    assert second["matched_columns"] == ["ID", "Name"]
+    assert second["ignored_columns"] == ["Extra"]
+    
+    main.write_cells(ws, 1, [(3, "Extra")])
+    assert main.get_headers(ws) == {"ID": 1, "Name": 2, "Extra": 3}
+    third = main.append_object_values(ws, {"ID": 3, "Name": "C", "Extra": "z"})
+    assert third["ignored_columns"] == []
+    assert [cell.value for cell in ws[4]] == [3, "C", "z"]
+    
+    main.delete_rows_bulk(ws, [1])
+    assert main.get_headers(ws) == {"1": 1, "A": 2}
+
+def test_write_cells_maintains_last_row():
+    """測試寫入與清空最後一列時，最後資料列標記保持正確"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    main.write_cells(ws, 1, [(1, "Header")])
+    assert main.get_real_last_row(ws) == 1
+    
+    main.write_cells(ws, 3, [(1, "Data")])
+    assert main.get_real_last_row(ws) == 3
+    
+    main.write_cells(ws, 3, [(1, "")])
+    assert main.get_real_last_row(ws) == 1
+
+def test_cleanup_compacts_empty_rows_in_one_pass():
+    """測試清理空白列時保留樣式、列高與合併儲存格"""
+    from openpyxl.styles import Font
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws["A1"] = "Header"
+    ws["A3"] = "Row3"
+    ws["A3"].font = Font(bold=True)
+    ws.row_dimensions[3].height = 30
+    ws["A6"] = "Merged"
+    ws.merge_cells("A6:B7")
+    ws["A9"] = "Last"
+    
+    main.cleanup_all_empty_rows(ws)
+    
+    assert [ws.cell(row=r, column=1).value for r in range(1, 7)] == ["Header", "Row3", "Merged", None, "Last", None]
+    assert ws["A2"].font.bold is True
+    assert ws.row_dimensions[2].height == 30
+    assert [str(r) for r in ws.merged_cells.ranges] == ["A3:B4"]
+    assert main.get_real_last_row(ws) == 5
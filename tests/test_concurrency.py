@@ -2,6 +2,8 @@
 並發安全測試
 """
 import pytest
+import subprocess
+import sys
 import threading
 import time
 from fastapi import status
@@ -113,6 +115,131 @@ def test_concurrent_mixed_operations(client, auth_headers, sample_excel_file):
     assert all(results["read"]), "Some read operations failed"
     assert all(results["update"]), "Some update operations failed"
 
+def test_group_commit_coalesces_appends(client, auth_headers, monkeypatch):
+    """測試並發新增會合併成較少次的儲存，且每個請求取得各自的列號"""
+    import main
+    NUM_THREADS = 10
+    save_count = []
+    original_save = main.save_workbook
+    
+    def counting_save(wb, file_path):
+        save_count.append(file_path)
+        original_save(wb, file_path)
+    
+    monkeypatch.setattr(main, "save_workbook", counting_save)
+    monkeypatch.setattr(main.group_committer, "window", 0.2)
+    
+    row_numbers = []
+    
+    def append_row(thread_id):
+        response = client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={
+                "file": "group_commit.xlsx",
+                "sheet": "Sheet1",
+                "values": [f"G{thread_id:03d}", "Group", "Dept", 1]
+            }
+        )
+        assert response.status_code == status.HTTP_200_OK
+        row_numbers.append(response.json()["row_number"])
+    
+    threads = [threading.Thread(target=append_row, args=(i,)) for i in range(NUM_THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert sorted(row_numbers) == list(range(1, NUM_THREADS + 1))
+    assert len(save_count) < NUM_THREADS
+
+def test_group_commit_discards_partial_writes(sample_excel_file):
+    """測試變更在寫入途中失敗時，其部分寫入不會隨同批次的其他變更一起儲存"""
+    import main
+    import openpyxl
+    
+    def failing(ws):
+        main.write_cells(ws, 10, [(1, "PARTIAL")])
+        raise RuntimeError("boom")
+    
+    outcomes = main.group_committer._commit(sample_excel_file, [
+        ("Sheet1", failing),
+        ("Sheet1", lambda ws: main.append_values(ws, ["E004", "Kept"])),
+    ])
+    assert isinstance(outcomes[0][1], RuntimeError)
+    assert outcomes[1] == (5, None)
+    
+    ws = openpyxl.load_workbook(sample_excel_file)["Sheet1"]
+    assert ws.max_row == 5
+    assert ws.cell(5, 2).value == "Kept"
+
+def test_atomic_save_keeps_original_on_failure(sample_excel_file):
+    """測試儲存失敗時原檔完整保留、暫存檔被清除，成功時保留原檔權限"""
+    import main
+    import os
+    import openpyxl
+    original = sample_excel_file.read_bytes()
+    
+    class BrokenWorkbook:
+        def save(self, f):
+            f.write(b"partial zip")
+            raise RuntimeError("disk full")
+    
+    with pytest.raises(RuntimeError):
+        main.atomic_save(BrokenWorkbook(), sample_excel_file)
+    assert sample_excel_file.read_bytes() == original
+    assert not list(sample_excel_file.parent.glob(".test.xlsx.*.tmp"))
+    
+    os.chmod(sample_excel_file, 0o640)
+    main.atomic_save(openpyxl.load_workbook(sample_excel_file), sample_excel_file)
+    assert os.stat(sample_excel_file).st_mode & 0o777 == 0o640
+    assert openpyxl.load_workbook(sample_excel_file)["Sheet1"]["A2"].value == "E001"
+
+def test_reads_do_not_wait_for_writer_lock(client, auth_headers, sample_excel_file):
+    """測試讀取不需鎖定：寫入者持有獨佔鎖定時仍可立即讀取已提交的版本"""
+    from main import file_lock_manager
+    file_lock_manager.acquire(str(sample_excel_file))
+    try:
+        start_time = time.time()
+        read = client.post(
+            "/api/excel/read",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1"}
+        )
+        headers = client.get("/api/excel/headers", headers=auth_headers, params={"file": "test.xlsx"})
+        sheets = client.get("/api/excel/sheets", headers=auth_headers, params={"file": "test.xlsx"})
+        elapsed = time.time() - start_time
+    finally:
+        file_lock_manager.release(str(sample_excel_file))
+    
+    assert read.status_code == status.HTTP_200_OK and read.json()["row_count"] == 4
+    assert headers.json()["headers"] == ["ID", "Name", "Department", "Salary"]
+    assert sheets.json()["sheets"] == ["Sheet1"]
+    assert elapsed < 1.0
+
+def test_readers_take_shared_lock_without_posix_replace(client, auth_headers, sample_excel_file, monkeypatch):
+    """測試無法取代開啟中檔案的平台(Windows)上，讀取與串流期間持有共用鎖定，結束後釋放"""
+    import main
+    from main import file_lock_manager
+    monkeypatch.setattr(main, "READER_LOCK_REQUIRED", True)
+    acquired = []
+    original_acquire = file_lock_manager.acquire_async
+    
+    async def recording(file_path, timeout=None, shared=False):
+        acquired.append(shared)
+        return await original_acquire(file_path, timeout, shared)
+    
+    monkeypatch.setattr(file_lock_manager, "acquire_async", recording)
+    assert client.post("/api/excel/read", headers=auth_headers, json={"file": "test.xlsx"}).status_code == status.HTTP_200_OK
+    assert client.get("/api/excel/headers", headers=auth_headers, params={"file": "test.xlsx"}).status_code == status.HTTP_200_OK
+    assert client.get("/api/excel/sheets", headers=auth_headers, params={"file": "test.xlsx"}).status_code == status.HTTP_200_OK
+    stream = client.post("/api/excel/read_stream", headers=auth_headers, json={"file": "test.xlsx"})
+    assert len(stream.text.splitlines()) == 4
+    missing = client.post("/api/excel/read_stream", headers=auth_headers, json={"file": "test.xlsx", "sheet": "Missing"})
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+    assert acquired == [True] * 5
+    assert str(sample_excel_file) not in file_lock_manager.locks
+
 def test_lock_timeout(client, auth_headers, monkeypatch, clean_test_env):
     """測試鎖定超時機制"""
     # 設定較短的超時時間
@@ -148,6 +275,133 @@ def test_lock_timeout(client, auth_headers, monkeypatch, clean_test_env):
         file_lock_manager.default_timeout = original_timeout
         file_lock_manager.release(test_file_path)
 
+def test_lock_fifo_handoff(clean_test_env):
+    """測試鎖定依到達順序交接，且釋放後不會殘留鎖定項目"""
+    from main import file_lock_manager
+    test_file_path = str(clean_test_env / "fifo.xlsx")
+    order = []
+    
+    def worker(worker_id):
+        assert file_lock_manager.acquire(test_file_path, timeout=5)
+        order.append(worker_id)
+        file_lock_manager.release(test_file_path)
+    
+    file_lock_manager.acquire(test_file_path)
+    threads = []
+    for i in range(5):
+        t = threading.Thread(target=worker, args=(i,))
+        threads.append(t)
+        t.start()
+        time.sleep(0.05)
+    file_lock_manager.release(test_file_path)
+    
+    for t in threads:
+        t.join()
+    
+    assert order == list(range(5))
+    assert test_file_path not in file_lock_manager.locks
+    assert test_file_path not in file_lock_manager.lock_times
+
+def test_shared_locks_allow_concurrent_readers(clean_test_env):
+    """測試多個讀取者可同時持有共用鎖定，寫入者需等待"""
+    from main import file_lock_manager
+    test_file_path = str(clean_test_env / "shared.xlsx")
+    
+    assert file_lock_manager.acquire(test_file_path, timeout=1, shared=True)
+    assert file_lock_manager.acquire(test_file_path, timeout=1, shared=True)
+    assert not file_lock_manager.acquire(test_file_path, timeout=0.2)
+    
+    file_lock_manager.release(test_file_path)
+    file_lock_manager.release(test_file_path)
+    assert file_lock_manager.acquire(test_file_path, timeout=1)
+    file_lock_manager.release(test_file_path)
+    assert test_file_path not in file_lock_manager.locks
+
+def test_waiting_writer_blocks_new_readers(clean_test_env):
+    """測試寫入者優先：已有寫入者等待時，新的讀取者排在其後"""
+    from main import file_lock_manager
+    test_file_path = str(clean_test_env / "writer_pref.xlsx")
+    order = []
+    
+    def writer():
+        assert file_lock_manager.acquire(test_file_path, timeout=5)
+        order.append("writer")
+        time.sleep(0.1)
+        file_lock_manager.release(test_file_path)
+    
+    def reader():
+        assert file_lock_manager.acquire(test_file_path, timeout=5, shared=True)
+        order.append("reader")
+        file_lock_manager.release(test_file_path)
+    
+    file_lock_manager.acquire(test_file_path, shared=True)
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    time.sleep(0.05)
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    time.sleep(0.05)
+    
+    assert order == []
+    file_lock_manager.release(test_file_path)
+    writer_thread.join()
+    reader_thread.join()
+    assert order == ["writer", "reader"]
+
+@pytest.mark.skipif(sys.platform == "win32", reason="fcntl is not available on Windows")
+def test_file_backend_locks_across_processes(clean_test_env):
+    """測試 file 後端會與其他行程持有的 flock 互斥"""
+    from main import FileLockManager
+    manager = FileLockManager(backend="file")
+    test_file_path = str(clean_test_env / "cross_process.xlsx")
+    lock_file = manager.lock_file_path(test_file_path)
+    
+    holder = subprocess.Popen(
+        [sys.executable, "-c", (
+            "import fcntl, os, sys, time\n"
+            f"fd = os.open({str(lock_file)!r}, os.O_RDWR | os.O_CREAT)\n"
+            "fcntl.flock(fd, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "time.sleep(1.0)\n"
+        )],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        assert not manager.acquire(test_file_path, timeout=0.3, shared=True)
+        assert test_file_path not in manager.locks
+        
+        assert manager.acquire(test_file_path, timeout=5)
+        manager.release(test_file_path)
+    finally:
+        holder.wait()
+
+def test_lock_wait_does_not_block_event_loop(client, auth_headers, clean_test_env):
+    """測試等待檔案鎖定時，其他請求(如健康檢查)仍可即時回應"""
+    from main import file_lock_manager
+    test_file_path = str(clean_test_env / "blocked.xlsx")
+    file_lock_manager.acquire(test_file_path)
+    
+    try:
+        waiter = threading.Thread(
+            target=client.post,
+            args=("/api/excel/append",),
+            kwargs={
+                "headers": auth_headers,
+                "json": {"file": "blocked.xlsx", "sheet": "Sheet1", "values": ["Waiting"]}
+            }
+        )
+        waiter.start()
+        time.sleep(0.3)
+        
+        start_time = time.time()
+        response = client.get("/")
+        assert response.status_code == status.HTTP_200_OK
+        assert time.time() - start_time < 0.5
+    finally:
+        file_lock_manager.release(test_file_path)
+        waiter.join()
+
 @pytest.mark.slow
 def test_concurrent_file_creation(client, auth_headers):
     """測試並發建立多個檔案"""
@@ -183,3 +437,163 @@ def test_concurrent_file_creation(client, auth_headers):
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
     assert data["count"] >= NUM_FILES
+
+@pytest.fixture
+def journaled(monkeypatch):
+    """啟用預寫日誌，並關閉自動檢查點(由測試自行控制)"""
+    import main
+    monkeypatch.setattr(main, "JOURNAL_ENABLED", True)
+    monkeypatch.setattr(main.journal, "checkpoint_ops", 10 ** 6)
+    monkeypatch.setattr(main.journal, "checkpoint_seconds", 3600)
+    yield main.journal
+    main.journal.checkpoint_all()
+
+def test_journal_commits_without_rewriting_file(client, auth_headers, sample_excel_file, journaled):
+    """測試日誌模式只附加紀錄，讀取、重新載入(重播)與檢查點的內容一致"""
+    import json
+    import openpyxl
+    from main import workbook_cache
+    original = sample_excel_file.read_bytes()
+    
+    # 空字串與公式在所有讀取方式下都與 data_only 重新載入相同，讀取為 None
+    rows = [["E100", "Journal", "IT", 0], ["E101", "", "IT", "=1+1"], ["E102", "Journal", "IT", 2]]
+    for values in rows:
+        response = client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "values": values}
+        )
+        assert response.status_code == status.HTTP_200_OK
+    response = client.post(
+        "/api/excel/batch",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1", "operations": [{"type": "delete", "row": 2}]}
+    )
+    assert response.json()["success"] is True
+    
+    def read_all(engine=None):
+        return client.post(
+            "/api/excel/read", headers=auth_headers, json={"file": "test.xlsx", "sheet": "Sheet1", "engine": engine}
+        ).json()["data"]
+    
+    assert sample_excel_file.read_bytes() == original
+    log_path = journaled.log_path(sample_excel_file)
+    assert [json.loads(line)["q"] for line in log_path.read_text().splitlines()] == [1, 2, 3, 4]
+    expected = read_all()
+    assert [row[0] for row in expected] == ["ID", "E002", "E003", "E100", "E101", "E102"]
+    assert expected[4] == ["E101", None, "IT", None]
+    
+    workbook_cache.clear()
+    assert read_all() == expected
+    workbook_cache.clear()
+    assert read_all("xml") == expected
+    
+    assert journaled.checkpoint(sample_excel_file)
+    assert not log_path.exists()
+    workbook_cache.clear()
+    assert read_all() == expected
+    wb = openpyxl.load_workbook(sample_excel_file)
+    assert journaled.checkpoint_seq(wb) == 4
+    assert wb["Sheet1"].max_row == 6
+
+def test_journal_replay_skips_checkpointed_records(client, auth_headers, sample_excel_file, journaled):
+    """測試檢查點後殘留的舊紀錄與寫入途中中斷的紀錄在重播時被略過"""
+    import main
+    response = client.post(
+        "/api/excel/append",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1", "values": ["E100", "Once", "IT", 1]}
+    )
+    assert response.json()["row_number"] == 5
+    log_path = journaled.log_path(sample_excel_file)
+    stale = log_path.read_bytes()
+    journaled.checkpoint(sample_excel_file)
+    
+    # 模擬在刪除日誌前當機，且最後一筆紀錄只寫了一半
+    log_path.write_bytes(stale + b'{"q": 2, "s": "Sheet1", "r": 6, "c": [[1, "E1')
+    main.workbook_cache.clear()
+    assert journaled.recover(sample_excel_file.parent) == 1
+    assert not log_path.exists()
+    
+    data = client.post(
+        "/api/excel/read", headers=auth_headers, json={"file": "test.xlsx", "sheet": "Sheet1"}
+    ).json()["data"]
+    assert [row[0] for row in data] == ["ID", "E001", "E002", "E003", "E100"]
+
+def test_journal_checkpoints_after_threshold(client, auth_headers, sample_excel_file, journaled):
+    """測試累積的紀錄達到筆數門檻時由背景執行緒寫回 xlsx"""
+    import openpyxl
+    journaled.checkpoint_ops = 2
+    for i in range(2):
+        client.post(
+            "/api/excel/append",
+            headers=auth_headers,
+            json={"file": "test.xlsx", "sheet": "Sheet1", "values": [f"E10{i}", "Threshold", "IT", i]}
+        )
+    log_path = journaled.log_path(sample_excel_file)
+    deadline = time.time() + 5
+    while log_path.exists() and time.time() < deadline:
+        time.sleep(0.05)
+    assert not log_path.exists()
+    assert openpyxl.load_workbook(sample_excel_file)["Sheet1"]["A6"].value == "E101"
+
+def test_read_stream_checkpoints_journal_first(client, auth_headers, sample_excel_file, journaled, monkeypatch):
+    """測試串流前先寫回日誌；無法取得鎖定寫回時返回 503，不會讀到缺少日誌變更的舊版本"""
+    import json
+    from main import file_lock_manager
+    client.post(
+        "/api/excel/append",
+        headers=auth_headers,
+        json={"file": "test.xlsx", "sheet": "Sheet1", "values": ["E100", "Stream", "IT", 1]}
+    )
+    monkeypatch.setattr(file_lock_manager, "default_timeout", 0.3)
+    file_lock_manager.acquire(str(sample_excel_file))
+    try:
+        response = client.post("/api/excel/read_stream", headers=auth_headers, json={"file": "test.xlsx"})
+    finally:
+        file_lock_manager.release(str(sample_excel_file))
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    
+    response = client.post("/api/excel/read_stream", headers=auth_headers, json={"file": "test.xlsx"})
+    assert json.loads(response.text.splitlines()[-1])[0] == "E100"
+    assert not journaled.log_path(sample_excel_file).exists()
+
+@pytest.mark.parametrize("mode", ["xml_append", "journal"])
+def test_commit_without_base_snapshot_keeps_formula_results(client, auth_headers, clean_test_env, request, mode):
+    """測試沒有前一版快照可套用時，讀取到的公式結果與重新載入檔案一致(不從寫入者的工作簿建立快照)"""
+    import openpyxl
+    import zipfile
+    from main import workbook_cache
+    if mode == "journal":
+        request.getfixturevalue("journaled")
+    file_path = clean_test_env / "formula.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+    ws.append(["Value", "Double"])
+    ws.append([5, "=A2*2"])
+    wb.save(file_path)
+    # 加入 Excel 計算後存下的公式結果
+    with zipfile.ZipFile(file_path) as zin:
+        members = {name: zin.read(name) for name in zin.namelist()}
+    members["xl/worksheets/sheet1.xml"] = members["xl/worksheets/sheet1.xml"].replace(b"<v />", b"<v>10</v>")
+    with zipfile.ZipFile(file_path, "w") as zout:
+        for name, data in members.items():
+            zout.writestr(name, data)
+    
+    response = client.post(
+        "/api/excel/append",
+        headers=auth_headers,
+        json={"file": "formula.xlsx", "sheet": "Sheet1", "values": [7]}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    
+    def read_all():
+        return client.post(
+            "/api/excel/read", headers=auth_headers, json={"file": "formula.xlsx", "sheet": "Sheet1"}
+        ).json()["data"]
+    
+    cached = read_all()
+    workbook_cache.clear()
+    assert cached == read_all()
+    assert cached[1] == [5, 10]